@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Bake a tileable 3D Perlin noise volume for test4_optimized_v2.py --volume
+"""
+
+import argparse
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+from test4_optimized_v2 import pnoise3_grid
+
+def bake(path, period, density):
+    """Write the (z, y, x) float32 volume covering one period per axis, a z plane at a time"""
+    period_x, period_y, period_z = period
+    shape = (period_z * density, period_y * density, period_x * density)
+    volume = open_memmap(path, mode="w+", dtype=np.float32, shape=shape)
+
+    # Only one plane is ever in memory; the rest goes straight to the file
+    xs = np.arange(shape[2]) / density
+    ys = np.arange(shape[1]) / density
+    for k in range(shape[0]):
+        volume[k] = pnoise3_grid(xs, ys, k / density, repeat=period)
+    volume.flush()
+    return shape
+
+def main():
+    parser = argparse.ArgumentParser(description="Bake a tileable 3D noise volume into an .npy file")
+    parser.add_argument("output", help="path of the .npy file to write")
+    parser.add_argument("--period", type=int, nargs=3, default=(32, 32, 8), metavar=("X", "Y", "Z"),
+                        help="noise units before the volume repeats along each axis (default: 32 32 8)")
+    parser.add_argument("--density", type=int, default=10, metavar="N",
+                        help="samples per noise unit along every axis (default: 10)")
+    args = parser.parse_args()
+    if min(args.period) < 1 or args.density < 1:
+        parser.error("--period and --density must be positive")
+
+    start_time = time.perf_counter()
+    shape = bake(args.output, tuple(args.period), args.density)
+    elapsed = time.perf_counter() - start_time
+    size = np.prod(shape) * 4 / 1024 / 1024
+    print(f"Baked {shape[2]}x{shape[1]}x{shape[0]} samples ({size:.1f} MB) in {elapsed:.1f}s to {args.output}")
+    print(f"Run with: --volume {args.output} --volume-density {args.density}")
+
+if __name__ == "__main__":
+    main()
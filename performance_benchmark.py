@@ -1,202 +1,290 @@
 #!/usr/bin/env python3
 """
-Performance benchmark comparing original vs optimized noise renderer
+Benchmark suite for the renderer test4_optimized_v2.py ships, stage by stage
 """
 
-import time
+import argparse
+import fcntl
+import json
+import os
+import platform
+import pty
+import struct
 import sys
-from noise import pnoise3
+import termios
+import threading
+import time
+import tty
 import numpy as np
-from collections import deque
-
-# Original implementation simulation
-def original_render_simulation(width, height, xoffset, yoffset, zoffset, mx, b, framecount):
-    """Simulates the original rendering approach without terminal output"""
-    frame_data = []
-    
-    for y in range(height):
-        linedata = ""
-        for x in range(width):
-            xpos = x/10 + xoffset
-            ypos = y/5 + yoffset
-            zpos = zoffset
-            
-            noiseval = float(pnoise3(xpos, ypos, zpos))
-            val = noiseval * mx + b
-            if val > 255:
-                val = 255
-            
-            # Simulate string concatenation
-            linedata += f"\x1B[48;2;{int(val)};{int(255-val)};{framecount % 255}m "
-        
-        frame_data.append(linedata)
-    
-    return frame_data
-
-# Optimized implementation
-class OptimizedNoiseRenderer:
+import test4_optimized_v2 as app
+
+SIZES = ["80x24", "120x40", "200x60"]
+
+# Renderer and app settings per mode; "fractal" and "diff" are built in make_case()
+MODES = {
+    "plain": {},
+    "half-block": {"half_block": True},
+    "snap": {"snap_to_lattice": True},
+    "quantize": {"quantize": 8},
+    "fractal": {},
+    "diff": {},
+}
+
+STAGES = ("noise", "colour", "encode", "diff", "write_devnull", "write_pty", "frame")
+
+# Offsets move like the app's default drift plus a wheel notch
+VELOCITY = (0.013, 0.007, 0.01)
+# Panning alone, for the modes whose savings need z to hold still: the scroll
+# ring and tile cache (snap), octave reuse (fractal) and unchanged cells (diff,
+# which also needs a palette that does not cycle, unlike the classic one's blue)
+PAN_VELOCITY = (0.013, 0.007, 0.0)
+MODE_VELOCITY = {"snap": PAN_VELOCITY, "fractal": PAN_VELOCITY, "diff": PAN_VELOCITY}
+HEADER = b"\x1B[1;1H\x1B[0mBenchmark\x1B[1E"
+
+class PtySink:
+    """A pty sized like the terminal, its master drained on a thread like a terminal emulator would"""
+
     def __init__(self, width, height):
-        self.width = width
-        self.height = height
-        self.noise_cache = {}
-        self.cache_max_size = 10000
-        self.frame_buffer = []
-        self.line_buffers = [[] for _ in range(height)]
-        self.rgb_template = "\x1B[48;2;{};{};{}m "
-        
-    def get_noise_cached(self, x, y, z):
-        key = (round(x, 2), round(y, 2), round(z, 2))
-        
-        if key in self.noise_cache:
-            return self.noise_cache[key]
-        
-        value = float(pnoise3(x, y, z))
-        
-        if len(self.noise_cache) >= self.cache_max_size:
-            items_to_remove = list(self.noise_cache.keys())[:self.cache_max_size // 5]
-            for k in items_to_remove:
-                del self.noise_cache[k]
-        
-        self.noise_cache[key] = value
-        return value
-    
-    def render_frame_optimized(self, xoffset, yoffset, zoffset, mx, b, framecount):
-        self.frame_buffer.clear()
-        
-        for y in range(self.height):
-            line_parts = self.line_buffers[y]
-            line_parts.clear()
-            
-            ypos = y/5 + yoffset
-            
-            for x in range(self.width):
-                xpos = x/10 + xoffset
-                zpos = zoffset
-                
-                noiseval = self.get_noise_cached(xpos, ypos, zpos)
-                val = int(noiseval * mx + b)
-                val = min(max(val, 0), 255)
-                
-                r, g, b_color = val, 255-val, framecount % 255
-                line_parts.append(self.rgb_template.format(r, g, b_color))
-            
-            self.frame_buffer.append(''.join(line_parts))
-        
-        return self.frame_buffer
-
-def benchmark_performance():
-    """Run performance benchmarks"""
-    
-    # Test parameters
-    width, height = 80, 24
-    frames = 100
-    
-    print("Performance Benchmark: Original vs Optimized Noise Renderer")
-    print("=" * 60)
-    print(f"Resolution: {width}x{height}")
-    print(f"Frames: {frames}")
-    print()
-    
-    # Initialize test parameters
-    xoffset = yoffset = zoffset = 0
-    mx, b = 127.5, 127.5
-    
-    # Test original implementation
-    print("Testing Original Implementation...")
-    start_time = time.time()
-    
-    for frame in range(frames):
-        original_render_simulation(width, height, xoffset, yoffset, zoffset, mx, b, frame)
-        xoffset += 0.01
-        yoffset += 0.01
-        zoffset += 0.01
-    
-    original_time = time.time() - start_time
-    original_fps = frames / original_time
-    
-    print(f"Original - Total time: {original_time:.3f}s, FPS: {original_fps:.1f}")
-    
-    # Test optimized implementation
-    print("Testing Optimized Implementation...")
-    renderer = OptimizedNoiseRenderer(width, height)
-    
-    # Reset offsets
-    xoffset = yoffset = zoffset = 0
-    
-    start_time = time.time()
-    
-    for frame in range(frames):
-        renderer.render_frame_optimized(xoffset, yoffset, zoffset, mx, b, frame)
-        xoffset += 0.01
-        yoffset += 0.01
-        zoffset += 0.01
-    
-    optimized_time = time.time() - start_time
-    optimized_fps = frames / optimized_time
-    
-    print(f"Optimized - Total time: {optimized_time:.3f}s, FPS: {optimized_fps:.1f}")
-    
-    # Calculate improvements
-    speedup = original_time / optimized_time
-    fps_improvement = (optimized_fps - original_fps) / original_fps * 100
-    
-    print()
-    print("Performance Results:")
-    print("-" * 30)
-    print(f"Speedup: {speedup:.2f}x")
-    print(f"FPS Improvement: {fps_improvement:.1f}%")
-    print(f"Time Reduction: {((original_time - optimized_time) / original_time * 100):.1f}%")
-    
-    # Cache effectiveness
-    cache_hit_ratio = (len(renderer.noise_cache) / (width * height * frames)) * 100
-    print(f"Cache entries: {len(renderer.noise_cache)}")
-    print(f"Cache effectiveness: {100 - cache_hit_ratio:.1f}% computation reduction")
-
-def memory_benchmark():
-    """Test memory usage patterns"""
-    print("\nMemory Usage Analysis:")
-    print("-" * 30)
-    
-    import tracemalloc
-    
-    width, height = 80, 24
-    frames = 50
-    
-    # Test original approach memory usage
-    tracemalloc.start()
-    
-    for frame in range(frames):
-        original_render_simulation(width, height, 0, 0, frame/10, 127.5, 127.5, frame)
-    
-    current, peak = tracemalloc.get_traced_memory()
-    tracemalloc.stop()
-    
-    print(f"Original - Peak memory: {peak / 1024 / 1024:.2f} MB")
-    
-    # Test optimized approach memory usage
-    tracemalloc.start()
-    
-    renderer = OptimizedNoiseRenderer(width, height)
-    for frame in range(frames):
-        renderer.render_frame_optimized(0, 0, frame/10, 127.5, 127.5, frame)
-    
-    current_opt, peak_opt = tracemalloc.get_traced_memory()
-    tracemalloc.stop()
-    
-    print(f"Optimized - Peak memory: {peak_opt / 1024 / 1024:.2f} MB")
-    print(f"Memory reduction: {((peak - peak_opt) / peak * 100):.1f}%")
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        fcntl.ioctl(self.slave, termios.TIOCSWINSZ, struct.pack("HHHH", height, width, 0, 0))
+        self.bytes_read = 0
+        self.reader = threading.Thread(target=self.drain, daemon=True)
+        self.reader.start()
+
+    def drain(self):
+        while True:
+            try:
+                data = os.read(self.master, 1 << 16)
+            except OSError:
+                return
+            if not data:
+                return
+            self.bytes_read += len(data)
+
+    def close(self):
+        os.close(self.slave)
+        self.reader.join(timeout=1)
+        os.close(self.master)
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def make_case(width, height, mode):
+    """Renderer, encoder and optional differ for one size and mode"""
+    options = dict(MODES[mode])
+    if mode == "fractal":
+        options["fractal"] = app.FractalNoise("fbm", x_scale=10, y_scale=5)
+    if mode == "diff":
+        options["palette"] = app.Palette("fire")
+    renderer = app.OptimizedNoiseRenderer(width, height, **options)
+    encoder = app.ByteFrameEncoder(renderer)
+    differ = app.FrameDiffer(width, height) if mode == "diff" else None
+    return renderer, encoder, differ
+
+def summarize(samples):
+    """Milliseconds: median, p95, mean and min of a list of durations in seconds"""
+    ms = np.asarray(samples) * 1000
+    return {"median_ms": float(np.median(ms)), "p95_ms": float(np.percentile(ms, 95)),
+            "mean_ms": float(ms.mean()), "min_ms": float(ms.min())}
+
+def bench_case(width, height, mode, frames, warmup):
+    """Render frames through every stage the app runs, timing each; returns {stage: summary}"""
+    renderer, encoder, differ = make_case(width, height, mode)
+    palette = renderer.palette
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    sink = PtySink(width, height)
+    timings = {stage: [] for stage in STAGES}
+    bytes_out = 0
+    diffs_sent = 0
+    velocity = MODE_VELOCITY.get(mode, VELOCITY)
+    samples = 0
+    xoffset = yoffset = zoffset = 0.0
+    mx = b = 127.5
+
+    try:
+        for frame in range(warmup + frames):
+            t0 = time.perf_counter()
+            field = renderer.sample_field(xoffset, yoffset, zoffset)
+            t1 = time.perf_counter()
+            vals, palette = renderer.colour_field(field, mx, b, frame)
+            t2 = time.perf_counter()
+            data = encoder.encode(HEADER, vals, palette)
+            t3 = time.perf_counter()
+            if differ:
+                diff = differ.encode(renderer.colours, encoder.frame_size)
+                if diff is not None:
+                    data = HEADER + diff.encode()
+                    diffs_sent += frame >= warmup
+            t4 = time.perf_counter()
+            app.write_all(sink.slave, data)
+            t5 = time.perf_counter()
+            app.write_all(devnull, data)
+            t6 = time.perf_counter()
+
+            if frame >= warmup:
+                timings["noise"].append(t1 - t0)
+                timings["colour"].append(t2 - t1)
+                timings["encode"].append(t3 - t2)
+                timings["diff"].append(t4 - t3)
+                timings["write_pty"].append(t5 - t4)
+                timings["write_devnull"].append(t6 - t5)
+                timings["frame"].append(t5 - t0)
+                bytes_out += len(data)
+                samples += renderer.samples_computed
+
+            # Settle the colour range the way the app does every 10 frames
+            if frame % 10 == 0:
+                mx, b = app.mxplusb(0, renderer.field_min, 255, renderer.field_max)
+            xoffset += velocity[0]
+            yoffset += velocity[1]
+            zoffset += velocity[2]
+    finally:
+        os.close(devnull)
+        sink.close()
+
+    if not differ:
+        del timings["diff"]
+    results = {stage: summarize(samples) for stage, samples in timings.items()}
+    if differ:
+        # Frames sent as a diff rather than falling back to the full repaint
+        results["diff"]["diff_share"] = diffs_sent / frames
+    results["frame"]["bytes_per_frame"] = bytes_out / frames
+    # Share of the frame's cells sampled afresh; reuse shows up as well below 1
+    results["noise"]["samples_share"] = samples / frames / (width * renderer.rows)
+    return results
+
+def mouse_reads(count=100000, chunk=4096):
+    """A trackpad flood of SGR reports cut into fixed-size reads, a wheel tick every 20 reports"""
+    reports = []
+    for i in range(count):
+        if i % 20 == 0:
+            reports.append(b"\x1b[<%d;%d;%dM" % (64 + (i // 20) % 2, i % 200 + 1, i % 60 + 1))
+        else:
+            reports.append(b"\x1b[<35;%d;%dM" % (i % 200 + 1, i % 60 + 1))
+    stream = b"".join(reports)
+    return [stream[i:i + chunk] for i in range(0, len(stream), chunk)]
+
+def bench_mouse(repeats):
+    """MouseParser throughput on the flood, one timing per pass over it"""
+    reads = mouse_reads()
+    samples = []
+    for _ in range(repeats):
+        parser = app.MouseParser()
+        start_time = time.perf_counter()
+        for data in reads:
+            parser.feed(data)
+        samples.append(time.perf_counter() - start_time)
+    result = summarize(samples)
+    result["reports_per_s"] = parser.reports / min(samples)
+    return {"parse": result}
+
+def run(args):
+    sizes = [parse_size(size) for size in args.sizes]
+    results = []
+    for width, height in sizes:
+        for mode in args.modes:
+            stages = bench_case(width, height, mode, args.frames, args.warmup)
+            for stage, summary in stages.items():
+                results.append({"size": f"{width}x{height}", "mode": mode, "stage": stage, **summary})
+            frame = stages["frame"]
+            print(f"{width:>4}x{height:<4} {mode:<11} frame {frame['median_ms']:7.2f}ms "
+                  f"(p95 {frame['p95_ms']:.2f}) " +
+                  " ".join(f"{stage} {summary['median_ms']:.2f}" for stage, summary in stages.items()
+                           if stage != "frame") +
+                  (f" ({stages['diff']['diff_share']:.0%} sent as diffs)" if "diff" in stages else ""),
+                  flush=True)
+    if not args.no_mouse:
+        for stage, summary in bench_mouse(5).items():
+            results.append({"size": "-", "mode": "mouse", "stage": stage, **summary})
+            print(f"{'-':>9} {'mouse':<11} {stage} {summary['median_ms']:.2f}ms "
+                  f"({summary['reports_per_s'] / 1e6:.2f}M reports/s)")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "frames": args.frames,
+            "warmup": args.warmup,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=1)
+        print(f"Results written to {args.output}")
+
+def compare(args):
+    """Print old vs new medians per size, mode and stage; exit 1 if any slowed past the threshold"""
+    with open(args.old) as fh:
+        old = {(r["size"], r["mode"], r["stage"]): r for r in json.load(fh)["results"]}
+    with open(args.new) as fh:
+        new = {(r["size"], r["mode"], r["stage"]): r for r in json.load(fh)["results"]}
+
+    regressions = 0
+    print(f"{'Size':>9} {'Mode':<11} {'Stage':<14} {'Old ms':>9} {'New ms':>9} {'Change':>8}")
+    for key in [key for key in old if key in new]:
+        before, after = old[key]["median_ms"], new[key]["median_ms"]
+        change = (after - before) / before * 100 if before else 0.0
+        # Sub-threshold times are dominated by timer noise, whatever their ratio
+        flag = ""
+        if after - before > args.min_ms and change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif before - after > args.min_ms and -change > args.threshold:
+            flag = "  improved"
+        print(f"{key[0]:>9} {key[1]:<11} {key[2]:<14} {before:9.3f} {after:9.3f} {change:+7.1f}%{flag}")
+    for path, ours, theirs in ((args.old, old, new), (args.new, new, old)):
+        missing = len(ours.keys() - theirs.keys())
+        if missing:
+            print(f"{missing} result(s) only in {path}, not compared")
+
+    print(f"{regressions} regression(s) over {args.threshold:g}% and {args.min_ms:g}ms")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the renderer in test4_optimized_v2.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="time every stage across sizes and modes")
+    run_parser.add_argument("--sizes", nargs="+", default=SIZES, metavar="WxH",
+                            help=f"terminal sizes (default: {' '.join(SIZES)})")
+    run_parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES),
+                            help="renderer modes (default: all)")
+    run_parser.add_argument("--frames", type=int, default=60, metavar="N",
+                            help="timed frames per case (default: 60)")
+    run_parser.add_argument("--warmup", type=int, default=5, metavar="N",
+                            help="untimed frames first, to fill caches and tables (default: 5)")
+    run_parser.add_argument("--no-mouse", action="store_true",
+                            help="skip the mouse parser benchmark")
+    run_parser.add_argument("-o", "--output", metavar="JSON",
+                            help="write the results to this file")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions between two result files")
+    compare_parser.add_argument("old", help="baseline results JSON")
+    compare_parser.add_argument("new", help="results JSON to check against it")
+    compare_parser.add_argument("--threshold", type=float, default=10, metavar="PCT",
+                                help="slowdown of the median counted as a regression (default: 10)")
+    compare_parser.add_argument("--min-ms", type=float, default=0.05, metavar="MS",
+                                help="ignore changes smaller than this (default: 0.05)")
+
+    # Bare invocation runs the suite, as the old script did
+    args = parser.parse_args(sys.argv[1:] or ["run"])
+    if args.command == "run":
+        if args.frames < 1 or args.warmup < 0:
+            run_parser.error("--frames must be positive and --warmup not negative")
+        try:
+            for size in args.sizes:
+                parse_size(size)
+        except ValueError:
+            run_parser.error("--sizes take the form WIDTHxHEIGHT, e.g. 120x40")
+        run(args)
+    else:
+        sys.exit(compare(args))
 
 if __name__ == "__main__":
-    benchmark_performance()
-    memory_benchmark()
-    
-    print("\n" + "=" * 60)
-    print("Key Optimizations Applied:")
-    print("- Noise value caching with LRU-style eviction")
-    print("- Pre-allocated string buffers to reduce allocations")
-    print("- Batch string operations instead of character-by-character")
-    print("- Reduced I/O calls by building complete frames before output")
-    print("- Eliminated redundant calculations")
-    print("- Improved input handling with better error handling")
-    print("- Added real-time FPS monitoring")
-    print("- Adaptive frame rate to maintain target performance")
\ No newline at end of file
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Run test4_optimized_v2.py under a pty and replay a mouse trace into it
+"""
+
+import argparse
+import fcntl
+import json
+import math
+import os
+import re
+import select
+import struct
+import subprocess
+import sys
+import tempfile
+import termios
+import time
+import numpy as np
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test4_optimized_v2.py")
+
+# Every frame starts by homing the cursor for the header, which echoes the mouse position
+FRAME_START = b"\x1B[1;1H\x1B[0m"
+HEADER_MOUSE = re.compile(rb"Mouse: *(\d+), *(\d+)")
+MOTION = re.compile(rb"\x1b\[<(\d+);(\d+);(\d+)M")
+
+TRACES = ("sweep", "scroll", "idle")
+
+def synthetic_trace(kind, width, height, duration, rate):
+    """(seconds, bytes) SGR reports: a circling pointer, the same with wheel notches, or nothing"""
+    trace = []
+    if kind == "idle":
+        return trace
+    cx, cy = (width + 1) / 2, (height + 1) / 2
+    for i in range(int(duration * rate)):
+        t = i / rate
+        # One lap every 4 seconds, so consecutive reports land on different cells
+        angle = t * math.pi / 2
+        x = int(cx + (width / 2 - 1) * math.cos(angle)) + 1
+        y = int(cy + (height / 2 - 1) * math.sin(angle)) + 1
+        trace.append((t, b"\x1b[<35;%d;%dM" % (x, y)))
+        if kind == "scroll" and i % 20 == 0:
+            trace.append((t, b"\x1b[<%d;%d;%dM" % (64 + (i // 20) % 2, x, y)))
+    return trace
+
+def load_trace(path):
+    """A trace file: one "<seconds> <report>" per line, ESC written as \\x1b; # starts a comment"""
+    trace = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            t, report = line.split(None, 1)
+            trace.append((float(t), report.encode("latin-1").decode("unicode_escape").encode("latin-1")))
+    trace.sort(key=lambda event: event[0])
+    return trace
+
+def save_trace(path, trace):
+    with open(path, "w") as fh:
+        for t, report in trace:
+            fh.write(f"{t:.6f} {report.decode('latin-1').encode('unicode_escape').decode()}\n")
+
+def launch(width, height, app_args, cwd):
+    """Start the app in cwd on a new pty of the given size; returns (process, master fd)"""
+    master, slave = os.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", height, width, 0, 0))
+    env = dict(os.environ, TERM=os.environ.get("HARNESS_TERM", "xterm-256color"))
+    # setsid() then claim the pty, so it is the controlling terminal and SIGWINCH works
+    process = subprocess.Popen([sys.executable, SCRIPT] + app_args,
+                               stdin=slave, stdout=slave, stderr=slave, env=env, cwd=cwd,
+                               start_new_session=True, close_fds=True,
+                               preexec_fn=lambda: fcntl.ioctl(0, termios.TIOCSCTTY, 0))
+    os.close(slave)
+    return process, master
+
+def run(args, trace):
+    # The app writes debug.txt into its working directory; keep that out of ours
+    with tempfile.TemporaryDirectory(prefix="pty_harness-") as scratch:
+        return measure(args, trace, scratch)
+
+def measure(args, trace, cwd):
+    process, master = launch(args.width, args.height, args.app_args, cwd)
+    frames = 0
+    bytes_out = 0
+    sent = 0
+    pending = []  # (send time, x, y) of motion reports not yet seen in a header
+    latencies = []
+    tail = b""
+    early = b""  # output before the first frame, shown if the app never gets that far
+    started = None  # the trace clock starts at the first frame, after imports and curses setup
+    launched = time.perf_counter()
+    next_event = 0
+    quit_at = None
+    elapsed = 0.0
+
+    try:
+        while True:
+            now = time.perf_counter()
+            if started is None and now - launched > args.startup_timeout:
+                raise RuntimeError(f"no frame within {args.startup_timeout}s of launch")
+            if started is not None:
+                clock = now - started
+                while next_event < len(trace) and trace[next_event][0] <= clock:
+                    report = trace[next_event][1]
+                    os.write(master, report)
+                    sent += 1
+                    match = MOTION.match(report)
+                    if match and int(match.group(1)) & 96 == 32:
+                        pending.append((now, int(match.group(2)), int(match.group(3))))
+                    next_event += 1
+                if quit_at is None and clock >= args.duration:
+                    quit_at = now
+                    elapsed = clock
+                    os.write(master, b"q")
+                if quit_at is not None and now - quit_at > 5:
+                    process.kill()
+                    raise RuntimeError("app did not exit within 5s of q")
+
+            if started is not None and next_event < len(trace):
+                timeout = max(0.0, trace[next_event][0] - (now - started))
+            else:
+                timeout = 0.05
+            if not select.select([master], [], [], min(timeout, 0.05))[0]:
+                continue
+            try:
+                data = os.read(master, 1 << 16)
+            except OSError:
+                break  # EIO: the app exited and closed the pty
+            if not data:
+                break
+            read_at = time.perf_counter()
+            if quit_at is not None:
+                continue  # curses teardown and the exit summary, not frames
+
+            # The tail only completes matches cut between reads; ones wholly inside
+            # it were counted with the previous read
+            chunk = tail + data
+            starts = chunk.count(FRAME_START) - tail.count(FRAME_START)
+            if started is None:
+                if not starts:
+                    early = (early + data)[-4096:]
+                    continue
+                started = read_at
+            frames += starts
+            bytes_out += len(data)
+            # First header showing a position sent since: that report's latency;
+            # earlier ones were coalesced away, so they are dropped
+            for match in HEADER_MOUSE.finditer(chunk):
+                if match.end() <= len(tail):
+                    continue
+                position = (int(match.group(1)), int(match.group(2)))
+                for i, (sent_at, x, y) in enumerate(pending):
+                    if (x, y) == position:
+                        latencies.append(read_at - sent_at)
+                        del pending[:i + 1]
+                        break
+            # Keep enough to complete a frame start or header cut between reads
+            tail = chunk[-24:]
+    finally:
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        os.close(master)
+    if started is None:
+        raise RuntimeError(f"app exited with status {process.returncode} before its first frame:\n"
+                           + early.decode("utf-8", "replace"))
+
+    return {
+        "size": f"{args.width}x{args.height}",
+        "app_args": args.app_args,
+        "duration_s": elapsed,
+        "exit_status": process.returncode,
+        "reports_sent": sent,
+        "frames": frames,
+        "fps": frames / elapsed if elapsed else 0.0,
+        "bytes_out": bytes_out,
+        "bytes_per_frame": bytes_out / frames if frames else 0.0,
+        "latency_samples": len(latencies),
+        "latency_ms": dict(zip(("p50", "p95", "p99", "max"),
+                               (float(v) for v in np.percentile(np.asarray(latencies) * 1000,
+                                                                 (50, 95, 99, 100)))))
+                      if latencies else None,
+        "cpu_user_s": usage.ru_utime,
+        "cpu_system_s": usage.ru_stime,
+        "cpu_percent": (usage.ru_utime + usage.ru_stime) / elapsed * 100 if elapsed else 0.0,
+        "max_rss_kb": usage.ru_maxrss,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run test4_optimized_v2.py under a pty, replay mouse input and measure it",
+        epilog="Arguments after -- go to the app, e.g. -- --half-block --fps 60; it runs in a "
+               "scratch directory, so give it absolute paths. "
+               "Latency needs the default header, which echoes the mouse position.")
+    parser.add_argument("--size", default="120x40", metavar="WxH",
+                        help="terminal size (default: 120x40)")
+    parser.add_argument("--duration", type=float, default=10, metavar="S",
+                        help="seconds to run after the first frame (default: 10)")
+    parser.add_argument("--trace", default="sweep", metavar="NAME|FILE",
+                        help=f"synthetic trace ({', '.join(TRACES)}) or a trace file (default: sweep)")
+    parser.add_argument("--rate", type=float, default=120, metavar="HZ",
+                        help="reports per second of synthetic traces (default: 120, a trackpad)")
+    parser.add_argument("--save-trace", metavar="FILE",
+                        help="write the trace replayed to FILE, in the format --trace reads")
+    parser.add_argument("--startup-timeout", type=float, default=10, metavar="S",
+                        help="give up if no frame arrives this long after launch (default: 10)")
+    parser.add_argument("--json", metavar="FILE", help="also write the report to FILE")
+    parser.add_argument("app_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    try:
+        args.width, args.height = (int(n) for n in args.size.lower().split("x"))
+    except ValueError:
+        parser.error("--size takes the form WIDTHxHEIGHT, e.g. 120x40")
+    if args.duration <= 0 or args.rate <= 0:
+        parser.error("--duration and --rate must be positive")
+
+    if args.trace in TRACES:
+        trace = synthetic_trace(args.trace, args.width, args.height, args.duration, args.rate)
+    else:
+        trace = load_trace(args.trace)
+    if args.save_trace:
+        save_trace(args.save_trace, trace)
+
+    try:
+        report = run(args, trace)
+    except RuntimeError as error:
+        sys.exit(f"pty_harness: {error}")
+    latency = report["latency_ms"]
+    print(f"Size {report['size']}, {report['duration_s']:.1f}s, app args: {' '.join(args.app_args) or '-'}")
+    print(f"Frames: {report['frames']} ({report['fps']:.1f} FPS), "
+          f"{report['bytes_per_frame'] / 1024:.1f}k per frame, {report['reports_sent']} reports sent")
+    if latency:
+        print(f"Input to output: p50 {latency['p50']:.1f}ms p95 {latency['p95']:.1f}ms "
+              f"p99 {latency['p99']:.1f}ms max {latency['max']:.1f}ms "
+              f"({report['latency_samples']} samples)")
+    else:
+        print("Input to output: no samples (idle trace, or the header is not showing the mouse)")
+    print(f"CPU: {report['cpu_user_s']:.2f}s user {report['cpu_system_s']:.2f}s system "
+          f"({report['cpu_percent']:.0f}% of one core), max RSS {report['max_rss_kb'] / 1024:.0f} MB")
+    if report["exit_status"]:
+        print(f"App exited with status {report['exit_status']}")
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=1)
+
+if __name__ == "__main__":
+    main()
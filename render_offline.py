@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Render frames of the noise animation to a file, without curses or a frame clock
+"""
+
+import argparse
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from test4_optimized_v2 import (OptimizedNoiseRenderer, ByteFrameEncoder, Palette, mxplusb)
+
+# Each ANSI frame homes the cursor, so `cat` of the file plays it back in a terminal
+HOME = b"\x1B[1;1H"
+RESET = b"\x1B[0m\n"
+
+def load_script(path):
+    """A motion script: "<frame> offset X Y Z" or "<frame> velocity VX VY VZ" per line, # comments"""
+    events = []
+    with open(path) as fh:
+        for number, line in enumerate(fh, 1):
+            line = line.split("#", 1)[0].split()
+            if not line:
+                continue
+            if len(line) != 5 or line[1] not in ("offset", "velocity"):
+                raise ValueError(f"{path}:{number}: expected '<frame> offset|velocity X Y Z'")
+            events.append((int(line[0]), line[1], tuple(float(v) for v in line[2:])))
+    return events
+
+def frame_offsets(frames, offset, velocity, events=()):
+    """(frames, 3) offsets: one simulation step of velocity per frame, as the app steps at 30 Hz"""
+    changes = {}
+    for frame, kind, values in events:
+        changes.setdefault(frame, []).append((kind, values))
+    position = np.array(offset, dtype=np.float64)
+    velocity = np.array(velocity, dtype=np.float64)
+    offsets = np.empty((frames, 3))
+    for frame in range(frames):
+        for kind, values in changes.get(frame, ()):
+            if kind == "offset":
+                position[:] = values
+            else:
+                velocity[:] = values
+        offsets[frame] = position
+        position += velocity
+    return offsets
+
+def rgb_shape(options):
+    """(rows, width, 3) of one raw RGB frame: half-block frames carry two sample rows per cell"""
+    rows = options["height"] * 2 if options["half_block"] else options["height"]
+    return rows, options["width"], 3
+
+def render_range(options, offsets, start, path):
+    """Render frames start.. of offsets into path; RGB frames go to their slot of the shared file"""
+    width, height = options["width"], options["height"]
+    renderer = OptimizedNoiseRenderer(width, height, quantize=options["quantize"],
+                                      half_block=options["half_block"],
+                                      palette=Palette(options["palette"]))
+    # A fixed range instead of the app's running min/max, so every frame and
+    # process colours the same value the same way
+    mx, b = mxplusb(0, options["range"][0], 255, options["range"][1])
+    rgb = options["format"] == "rgb"
+    encoder = None if rgb else ByteFrameEncoder(renderer)
+    frame_bytes = int(np.prod(rgb_shape(options)))
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        position = start * frame_bytes if rgb else 0
+        for frame, (xoffset, yoffset, zoffset) in enumerate(offsets, start):
+            field = renderer.sample_field(xoffset, yoffset, zoffset)
+            vals, palette = renderer.colour_field(field, mx, b, frame)
+            if rgb:
+                colours = renderer.colours
+                if renderer.half_block:
+                    # (cell row, column, upper/lower, rgb) to (sample row, column, rgb)
+                    colours = colours.reshape(height, width, 2, 3).transpose(0, 2, 1, 3)
+                data = np.ascontiguousarray(colours).data
+            else:
+                data = encoder.encode(HOME, vals, palette)
+            view = memoryview(data).cast("B")
+            while view:
+                written = os.pwrite(fd, view, position)
+                view = view[written:]
+                position += written
+    finally:
+        os.close(fd)
+    return len(offsets)
+
+def render(options, offsets, output, processes):
+    """Render every frame into output, splitting the frames into one contiguous range per process"""
+    rgb = options["format"] == "rgb"
+    # Truncate first; RGB ranges then write into their own slots of the one file
+    open(output, "wb").close()
+    if processes == 1:
+        render_range(options, offsets, 0, output)
+    else:
+        ranges = [r for r in np.array_split(np.arange(len(offsets)), processes) if len(r)]
+        parts = [output if rgb else f"{output}.part{i}" for i in range(len(ranges))]
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(render_range, options, offsets[r[0]:r[-1] + 1], int(r[0]), part)
+                       for r, part in zip(ranges, parts)]
+            for future in futures:
+                future.result()
+        if not rgb:
+            # ANSI frames vary in size, so each range went to its own part file
+            with open(output, "wb") as out:
+                for part in parts:
+                    with open(part, "rb") as fh:
+                        shutil.copyfileobj(fh, out)
+                    os.remove(part)
+    if not rgb:
+        with open(output, "ab") as out:
+            out.write(RESET)
+
+def main():
+    parser = argparse.ArgumentParser(description="Render noise animation frames to a file, headless")
+    parser.add_argument("output", help="file to write")
+    parser.add_argument("--size", default="120x40", metavar="WxH",
+                        help="frame size in terminal cells (default: 120x40)")
+    parser.add_argument("--frames", type=int, default=300, metavar="N",
+                        help="frames to render, one 30 Hz simulation step each (default: 300)")
+    parser.add_argument("--format", choices=("ansi", "rgb"), default="ansi",
+                        help="ANSI escapes as the app draws them, or raw uint8 RGB frames (default: ansi)")
+    parser.add_argument("--offset", type=float, nargs=3, default=(0, 0, 0), metavar=("X", "Y", "Z"),
+                        help="starting offsets (default: 0 0 0)")
+    parser.add_argument("--velocity", type=float, nargs=3, default=(0.01, 0.01, 0),
+                        metavar=("VX", "VY", "VZ"),
+                        help="offset change per frame (default: 0.01 0.01 0, the app's start)")
+    parser.add_argument("--script", metavar="FILE",
+                        help="lines of '<frame> offset X Y Z' or '<frame> velocity VX VY VZ' "
+                             "applied from that frame on")
+    parser.add_argument("--half-block", action="store_true",
+                        help="two samples per cell with ▀, as the app's --half-block")
+    parser.add_argument("--quantize", type=int, default=1, metavar="N",
+                        help="snap colour values to multiples of N (default: 1)")
+    parser.add_argument("--palette", choices=Palette.NAMES, default="classic",
+                        help="colour gradient for noise values (default: classic)")
+    parser.add_argument("--range", type=float, nargs=2, default=(-0.76, 0.76), metavar=("MIN", "MAX"),
+                        help="noise values mapped to 0 and 255 (default: -0.76 0.76, "
+                             "what the app settles on)")
+    parser.add_argument("--processes", type=int, default=1, metavar="N",
+                        help="render contiguous frame ranges in N processes (default: 1)")
+    args = parser.parse_args()
+    try:
+        width, height = (int(n) for n in args.size.lower().split("x"))
+    except ValueError:
+        parser.error("--size takes the form WIDTHxHEIGHT, e.g. 120x40")
+    if width < 1 or height < 1 or args.frames < 1 or args.processes < 1:
+        parser.error("--size, --frames and --processes must be positive")
+    if args.range[0] >= args.range[1]:
+        parser.error("--range MIN must be below MAX")
+    try:
+        events = load_script(args.script) if args.script else ()
+    except ValueError as error:
+        parser.error(str(error))
+
+    options = {"width": width, "height": height, "half_block": args.half_block,
+               "quantize": args.quantize, "palette": args.palette,
+               "range": tuple(args.range), "format": args.format}
+    offsets = frame_offsets(args.frames, args.offset, args.velocity, events)
+
+    start_time = time.perf_counter()
+    render(options, offsets, args.output, min(args.processes, args.frames))
+    elapsed = time.perf_counter() - start_time
+    size = os.path.getsize(args.output) / 1024 / 1024
+    print(f"Rendered {args.frames} frames ({size:.1f} MB) in {elapsed:.2f}s, "
+          f"{args.frames / elapsed:.1f} frames/s with {args.processes} process(es), to {args.output}")
+    if args.format == "rgb":
+        rows, columns, _ = rgb_shape(options)
+        print(f"Encode with: ffmpeg -f rawvideo -pix_fmt rgb24 -s {columns}x{rows} -r 30 "
+              f"-i {args.output} out.mp4")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 #!/usr/bin/python3 -u
 
-from noise import pnoise3
 import sys
 sys.stdout.softspace=False
 import time
@@ -8,8 +7,18 @@ import curses
 import signal
 import select
 import os
+import re
+import math
+import argparse
+import asyncio
+import atexit
+import cProfile
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from collections import deque
+from collections import deque, namedtuple, OrderedDict
 
 def tb_lineno(tb):
     c = tb.tb_frame.f_code
@@ -28,43 +37,752 @@ def signal_handler(sig, frame):
     print('Exiting...')
     curses.curs_set(1)
     curses.endwin()
-    print("Min: %5f" % minfound)
-    print("Max: %5f" % maxfound)
+    if monitor is not None:
+        print(monitor.summary())
+    if profiler is not None and profiler.active:
+        base = profiler.stop()
+        if base:
+            print("Profile: %s.pstats, %s.collapsed" % (base, base))
+        else:
+            print("Profile not saved: %s" % profiler.error)
+    print("Noise range: %5f .. %5f" % (minfound, maxfound))
     sys.exit(0)
 
+# Set by main() so the exit summary can report on the run
+monitor = None
+profiler = None
+
 def mxplusb(exp1, act1, exp2, act2):
     m = (exp2 - exp1) / (act2 - act1)
     b = exp1 - (m * act1)
     return [m, b]
 
+# Permutation and gradient tables copied from the noise library's _noise.h so
+# the batched field below matches pnoise3 sample for sample
+PERM = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225,
+    140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148,
+    247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32,
+    57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175,
+    74, 165, 71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122,
+    60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54,
+    65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169,
+    200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64,
+    52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212,
+    207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213,
+    119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
+    129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104,
+    218, 246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241,
+    81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181, 199, 106, 157,
+    184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93,
+    222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180,
+], dtype=np.intp)
+PERM = np.concatenate([PERM, PERM])
+
+GRAD3 = np.array([
+    [1, 1, 0], [-1, 1, 0], [1, -1, 0], [-1, -1, 0],
+    [1, 0, 1], [-1, 0, 1], [1, 0, -1], [-1, 0, -1],
+    [0, 1, 1], [0, -1, 1], [0, 1, -1], [0, -1, -1],
+    [1, 0, -1], [-1, 0, -1], [0, -1, 1], [0, 1, 1],
+], dtype=np.float32)
+
+# Gradient components indexed directly by hash (saves the "& 15" per corner)
+GRAD_X = GRAD3[PERM & 15, 0]
+GRAD_Y = GRAD3[PERM & 15, 1]
+GRAD_Z = GRAD3[PERM & 15, 2]
+
+def lattice_axis(coords, repeat=None):
+    """Split coordinates into wrapped lattice indices, fractions and fade weights"""
+    coords = np.asarray(coords, dtype=np.float32)
+    cell = np.floor(coords)
+    frac = coords - cell
+    fade = frac * frac * frac * (frac * (frac * 6 - 15) + 10)
+    if repeat is None:
+        i = cell.astype(np.intp) & 255
+        return i, (i + 1) & 255, frac, fade
+    # As pnoise3's repeat: lattice cells taken modulo the period (C fmod, so
+    # only non-negative coordinates tile)
+    i = np.floor(np.fmod(coords, np.float32(repeat))).astype(np.intp)
+    return i & 255, np.fmod(i + 1, repeat) & 255, frac, fade
+
+def pnoise3_grid(xs, ys, z, repeat=None):
+    """Batched pnoise3 over every (ys[row], xs[col], z); returns (len(ys), len(xs)) float32
+    
+    repeat is an optional (x, y, z) period in noise units, like pnoise3's repeatx/y/z.
+    """
+    repeat_x, repeat_y, repeat_z = repeat or (None, None, None)
+    xi, xii, fx, u = lattice_axis(xs, repeat_x)
+    yj, yjj, fy, v = lattice_axis(ys, repeat_y)
+    zk, zkk, fz, w = lattice_axis(z, repeat_z)
+
+    # x varies along columns, y along rows, z is a single slice
+    yj, yjj, fy, v = yj[:, None], yjj[:, None], fy[:, None], v[:, None]
+    fx1 = fx - 1
+    fy1 = fy - 1
+    fz1 = fz - 1
+
+    A = PERM[xi]
+    B = PERM[xii]
+    AA = PERM[A + yj]
+    AB = PERM[A + yjj]
+    BA = PERM[B + yj]
+    BB = PERM[B + yjj]
+
+    def grad(h, gx, gy, gz):
+        return GRAD_X[h] * gx + GRAD_Y[h] * gy + GRAD_Z[h] * gz
+
+    def lerp(t, a, b):
+        return a + t * (b - a)
+
+    near = lerp(v, lerp(u, grad(AA + zk, fx, fy, fz), grad(BA + zk, fx1, fy, fz)),
+                   lerp(u, grad(AB + zk, fx, fy1, fz), grad(BB + zk, fx1, fy1, fz)))
+    far = lerp(v, lerp(u, grad(AA + zkk, fx, fy, fz1), grad(BA + zkk, fx1, fy, fz1)),
+                  lerp(u, grad(AB + zkk, fx, fy1, fz1), grad(BB + zkk, fx1, fy1, fz1)))
+    return lerp(w, near, far).astype(np.float32, copy=False)
+
+def noise_band_worker(conn):
+    """Worker loop: fill its band of rows in the shared frame for every offset triple received"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C and shuts us down
+    shm = None
+    frame = band = None
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        if message[0] == "layout":
+            # Only sent on start-up and resize, never per frame
+            _, name, width, rows, start, stop, x_scale, y_scale = message
+            if shm is None or shm.name != name:
+                if shm is not None:
+                    shm.close()
+                shm = shared_memory.SharedMemory(name=name)
+            frame = np.ndarray((rows, width), dtype=np.float32, buffer=shm.buf)
+            band = slice(start, stop)
+            xs = np.arange(width) / x_scale
+            ys = np.arange(rows)[band] / y_scale
+            continue
+        xoffset, yoffset, zoffset = message
+        frame[band] = pnoise3_grid(xs + xoffset, ys + yoffset, zoffset)
+        conn.send(True)
+    frame = None
+    if shm is not None:
+        shm.close()
+
+class NoiseWorkerPool:
+    """Persistent worker processes that render row bands of a frame into shared memory"""
+    
+    def __init__(self, processes):
+        self.processes = processes
+        self.shape = (0, 0)
+        self.layout = None
+        
+        # Create the segment before forking so every worker shares our resource tracker
+        self.shm = shared_memory.SharedMemory(create=True, size=4096)
+        self.frame = None
+        
+        self.conns = []
+        self.workers = []
+        for _ in range(processes):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=noise_band_worker, args=(child_conn,), daemon=True)
+            worker.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.workers.append(worker)
+    
+    def set_layout(self, width, rows, x_scale, y_scale):
+        """Point the workers at a frame of this size, growing the shared segment if needed"""
+        layout = (width, rows, x_scale, y_scale)
+        if layout == self.layout:
+            return
+        
+        nbytes = width * rows * 4
+        if nbytes > self.shm.size:
+            # Workers re-attach by name; the old segment goes once they let go of it
+            old = self.shm
+            self.frame = None
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes + nbytes // 2)
+            old.close()
+            old.unlink()
+        self.frame = np.ndarray((rows, width), dtype=np.float32, buffer=self.shm.buf)
+        
+        bounds = np.linspace(0, rows, self.processes + 1).astype(int).tolist()
+        for conn, start, stop in zip(self.conns, bounds, bounds[1:]):
+            conn.send(("layout", self.shm.name, width, rows, start, stop, x_scale, y_scale))
+        self.layout = layout
+    
+    def sample(self, xoffset, yoffset, zoffset):
+        """Render one frame across the workers; returns a view of the shared frame"""
+        for conn in self.conns:
+            conn.send((xoffset, yoffset, zoffset))
+        for conn in self.conns:
+            conn.recv()
+        return self.frame
+    
+    def close(self):
+        if self.shm is None:
+            return
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join(timeout=1)
+        self.frame = None
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+class StageHistogram:
+    """Durations in log-spaced buckets, HDR-style, over a rolling window and the whole run"""
+    
+    BUCKETS_PER_OCTAVE = 8  # ~9% wide buckets
+    BUCKETS = 30 * BUCKETS_PER_OCTAVE  # 1us up to ~18 minutes
+    
+    def __init__(self, window=300):
+        self.recent = deque(maxlen=window)
+        self.window_counts = [0] * self.BUCKETS
+        self.counts = [0] * self.BUCKETS
+        self.total = 0.0
+        self.max = 0.0
+    
+    def bucket(self, seconds):
+        if seconds < 1e-6:
+            return 0
+        return min(int(math.log2(seconds * 1e6) * self.BUCKETS_PER_OCTAVE), self.BUCKETS - 1)
+    
+    def record(self, seconds):
+        if len(self.recent) == self.recent.maxlen:
+            self.window_counts[self.bucket(self.recent[0])] -= 1
+        self.recent.append(seconds)
+        index = self.bucket(seconds)
+        self.window_counts[index] += 1
+        self.counts[index] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def percentiles(self, whole_run=False):
+        """p50, p95, p99 (bucket upper bounds) and max, in milliseconds"""
+        counts = self.counts if whole_run else self.window_counts
+        n = sum(counts)
+        if not n:
+            return 0.0, 0.0, 0.0, 0.0
+        results = []
+        targets = [n * 0.50, n * 0.95, n * 0.99]
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            while targets and seen >= targets[0]:
+                targets.pop(0)
+                results.append(2 ** ((index + 1) / self.BUCKETS_PER_OCTAVE) / 1000)
+            if not targets:
+                break
+        peak = (self.max if whole_run else max(self.recent)) * 1000
+        # A bucket's upper bound can overshoot the largest value actually in it
+        return min(results[0], peak), min(results[1], peak), min(results[2], peak), peak
+
+class StageTimers:
+    """Lap timer over the phases of each frame, one histogram per stage"""
+    
+    STAGES = ("input", "sim", "noise", "colour", "encode", "diff", "write", "sleep")
+    
+    def __init__(self):
+        self.histograms = {stage: StageHistogram() for stage in self.STAGES}
+        self.mark = time.perf_counter()
+        self.frames = 0
+        self.bytes_total = 0
+        self.samples_total = 0
+        self.last_bytes = 0
+        self.last_samples = 0
+    
+    def start(self):
+        self.mark = time.perf_counter()
+    
+    def lap(self, stage):
+        """Charge the time since the previous lap (or start) to stage"""
+        now = time.perf_counter()
+        self.histograms[stage].record(now - self.mark)
+        self.mark = now
+    
+    def record(self, stage, seconds):
+        self.histograms[stage].record(seconds)
+    
+    def end_frame(self, bytes_written, samples):
+        self.frames += 1
+        self.bytes_total += bytes_written
+        self.samples_total += samples
+        self.last_bytes = bytes_written
+        self.last_samples = samples
+    
+    def overlay(self):
+        """One-line p50/p95 per stage plus this frame's output and samples, for the header"""
+        # Sizes go first so a narrow terminal clips the least interesting stages instead
+        parts = [f"Out: {self.last_bytes / 1024:.1f}k Samples: {self.last_samples} | p50/p95ms"]
+        for stage, histogram in self.histograms.items():
+            if histogram.recent:
+                p50, p95, _, _ = histogram.percentiles()
+                parts.append(f"{stage} {p50:.2f}/{p95:.2f}")
+        return " ".join(parts)
+    
+    def summary(self):
+        lines = [f"{'Stage':<8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms, whole run)"]
+        for stage, histogram in self.histograms.items():
+            if histogram.recent:
+                values = histogram.percentiles(whole_run=True)
+                lines.append(f"{stage:<8} " + " ".join(f"{value:8.2f}" for value in values))
+        if self.frames:
+            lines.append(f"Per frame: {self.bytes_total / self.frames / 1024:.1f}k written, "
+                         f"{self.samples_total / self.frames:.0f} samples computed")
+        return "\n".join(lines)
+
 class PerformanceMonitor:
-    def __init__(self, window_size=60):
-        self.frame_times = deque(maxlen=window_size)
-        self.last_frame_time = time.time()
+    def __init__(self, window_size=60, jitter_window=600):
+        # FPS averages the last window_size frames, percentiles use the longer history
+        self.window_size = window_size
+        self.frame_times = deque(maxlen=max(window_size, jitter_window))
+        self.work_times = deque(maxlen=window_size)  # time spent rendering, without the sleep
+        self.last_frame_time = time.perf_counter()
+        self.deadlines_missed = 0
+        self.frames_skipped = 0
+        self.frames_rendered = 0
+        self.started = self.last_frame_time
+        # Per-stage timing, None (and free) unless turned on
+        self.stages = None
+    
+    def enable_stages(self):
+        if self.stages is None:
+            self.stages = StageTimers()
+        return self.stages
     
     def update(self):
-        current_time = time.time()
+        current_time = time.perf_counter()
         frame_time = current_time - self.last_frame_time
         self.frame_times.append(frame_time)
         self.last_frame_time = current_time
+        self.frames_rendered += 1
         return frame_time
     
     def get_fps(self):
         if len(self.frame_times) < 2:
             return 0
-        return 1.0 / (sum(self.frame_times) / len(self.frame_times))
+        recent = list(self.frame_times)[-self.window_size:]
+        return 1.0 / (sum(recent) / len(recent))
+    
+    def add_work_time(self, seconds):
+        self.work_times.append(seconds)
+    
+    def get_work_time(self, frames):
+        """Mean render time of the last frames rendered"""
+        recent = list(self.work_times)[-frames:]
+        return sum(recent) / len(recent) if recent else 0.0
+    
+    def get_percentiles(self):
+        """p50/p95/p99 of the time between rendered frames, in milliseconds"""
+        if len(self.frame_times) < 2:
+            return 0.0, 0.0, 0.0
+        p50, p95, p99 = np.percentile(self.frame_times, (50, 95, 99)) * 1000
+        return float(p50), float(p95), float(p99)
+    
+    def summary(self):
+        """End-of-run report: frame counts and pacing, then the stage table if it was on"""
+        elapsed = time.perf_counter() - self.started
+        p50, p95, p99 = self.get_percentiles()
+        lines = [f"Frames: {self.frames_rendered} rendered in {elapsed:.1f}s "
+                 f"({self.frames_rendered / elapsed:.1f} FPS), {self.frames_skipped} skipped, "
+                 f"{self.deadlines_missed} deadlines missed; "
+                 f"frame time p50/p95/p99 {p50:.1f}/{p95:.1f}/{p99:.1f}ms"]
+        if self.stages:
+            lines.append(self.stages.summary())
+        return "\n".join(lines)
+
+class QualityController:
+    """Coarsens or refines the renderer's sampling scale to keep render time within budget"""
+    
+    def __init__(self, monitor, budget, max_scale=4, window=10, cooldown=30):
+        self.monitor = monitor
+        # Hysteresis: coarsen above 90% of the budget, refine only below 50%
+        self.high = budget * 0.9
+        self.low = budget * 0.5
+        self.max_scale = max_scale
+        self.window = window
+        self.cooldown = cooldown  # frames to settle after a change before judging again
+        self.scale = 1
+        self.frames_since_change = 0
+    
+    def update(self):
+        """Call once per rendered frame; returns the scale to sample the next one at"""
+        self.frames_since_change += 1
+        if self.frames_since_change < max(self.window, self.cooldown):
+            return self.scale
+        work = self.monitor.get_work_time(self.window)
+        if work > self.high and self.scale < self.max_scale:
+            self.scale += 1
+            self.frames_since_change = 0
+        elif work < self.low and self.scale > 1:
+            self.scale -= 1
+            self.frames_since_change = 0
+        return self.scale
+
+class FrameScheduler:
+    """Absolute frame deadlines on the monotonic clock; fps 0 runs uncapped"""
+    
+    MAX_SKIP = 4  # render at least one of every MAX_SKIP + 1 ticks, however far behind
+    MAX_LAG = 8  # more periods behind than this (e.g. after SIGSTOP) resets the schedule
+    
+    def __init__(self, fps, monitor):
+        self.period = 1.0 / fps if fps > 0 else 0.0
+        self.monitor = monitor
+        self.deadline = None
+        self.skipped = 0  # consecutive ticks not rendered
+    
+    def begin(self):
+        """Start a tick; returns False when it is already past its deadline and should not render"""
+        now = time.perf_counter()
+        if self.deadline is None or now - self.deadline > self.MAX_LAG * self.period:
+            self.deadline = now
+        # Deadlines advance by whole periods from the previous one, so sleep
+        # overshoot and slow frames are caught up instead of accumulating
+        self.deadline += self.period
+        if now > self.deadline and self.skipped < self.MAX_SKIP:
+            self.skipped += 1
+            self.monitor.frames_skipped += 1
+            return False
+        self.skipped = 0
+        return True
+    
+    def end(self, rendered):
+        """Finish a tick; returns how long to sleep until its deadline"""
+        remaining = self.deadline - time.perf_counter()
+        # Skipped ticks were already late and are counted as skips, not misses
+        if rendered and remaining < 0 and self.period:
+            self.monitor.deadlines_missed += 1
+        return max(0.0, remaining)
+
+class ZKeyframes:
+    """Full noise slices every dz along z, blended linearly for the frames in between"""
+    
+    def __init__(self, dz, x_scale, y_scale, margin_cols=8, margin_rows=4):
+        self.dz = dz
+        self.x_scale = x_scale
+        self.y_scale = y_scale
+        # Slices extend past the view so panning reads them at an offset for the
+        # couple of keyframe intervals each one is in use
+        self.margin_cols = margin_cols
+        self.margin_rows = margin_rows
+        self.slabs = {}  # keyframe index -> (lattice x, lattice y, samples)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keyframe")
+        self.pending = None  # (index, future) of the keyframe computed ahead
+        self.last_z = None
+        self.samples_computed = 0
+    
+    def compute(self, k, lx, ly, ncols, nrows):
+        """Keyframe k over the view at lattice (lx, ly) plus the margins"""
+        ox = lx - self.margin_cols
+        oy = ly - self.margin_rows
+        xs = (np.arange(ncols + 2 * self.margin_cols) + ox) / self.x_scale
+        ys = (np.arange(nrows + 2 * self.margin_rows) + oy) / self.y_scale
+        return ox, oy, pnoise3_grid(xs, ys, k * self.dz)
+    
+    def view(self, k, lx, ly, ncols, nrows):
+        """The nrows x ncols window of keyframe k at lattice (lx, ly), computing it if need be"""
+        if self.pending and self.pending[0] == k:
+            self.slabs[k] = self.pending[1].result()  # usually done by now
+            self.samples_computed += self.slabs[k][2].size
+            self.pending = None
+        entry = self.slabs.get(k)
+        if entry is not None:
+            ox, oy, samples = entry
+            top, left = ly - oy, lx - ox
+            if (top >= 0 and left >= 0 and top + nrows <= samples.shape[0]
+                    and left + ncols <= samples.shape[1]):
+                return samples[top:top + nrows, left:left + ncols]
+        
+        # Missing, or panned (or resized) beyond the margins
+        self.slabs[k] = self.compute(k, lx, ly, ncols, nrows)
+        self.samples_computed += self.slabs[k][2].size
+        return self.view(k, lx, ly, ncols, nrows)
+    
+    def sample(self, lx, ly, z, ncols, nrows):
+        """Blend the keyframes either side of z over the view at lattice (lx, ly)"""
+        self.samples_computed = 0
+        position = z / self.dz
+        k = int(np.floor(position))
+        t = np.float32(position - k)
+        
+        for old in [key for key in self.slabs if key not in (k, k + 1)]:
+            del self.slabs[old]
+        lower = self.view(k, lx, ly, ncols, nrows)
+        upper = self.view(k + 1, lx, ly, ncols, nrows)
+        field = lower + (upper - lower) * t
+        
+        # Start on the keyframe z is heading for while these frames are drawn
+        ahead = None
+        if self.last_z is not None and z != self.last_z:
+            ahead = k + 2 if z > self.last_z else k - 1
+        self.last_z = z
+        if ahead is not None and ahead not in self.slabs and (
+                self.pending is None or self.pending[0] != ahead):
+            if self.pending:
+                self.pending[1].cancel()
+            self.pending = (ahead, self.executor.submit(self.compute, ahead, lx, ly, ncols, nrows))
+        return field
+
+class FractalNoise:
+    """Octave sums of pnoise3_grid: "fbm", "ridged" or "turbulence", normalised like pnoise3's octaves"""
+    
+    MODES = ("fbm", "ridged", "turbulence")
+    # An octave whose lattice cell spans at least this many samples along both
+    # axes is smooth enough to be shifted by interpolation instead of recomputed
+    REUSE_SAMPLES = 4
+    
+    def __init__(self, mode, octaves=4, lacunarity=2.0, persistence=0.5, x_scale=10, y_scale=5):
+        self.mode = mode
+        self.octaves = octaves
+        self.lacunarity = lacunarity
+        self.persistence = persistence
+        self.x_scale = x_scale
+        self.y_scale = y_scale
+        self.kept = {}  # octave -> (x, y, z, field sampled with a one-cell margin)
+        self.octaves_computed = 0
+        self.octaves_reused = 0
+    
+    def sample(self, x_coords, y_coords, xoffset, yoffset, zoffset):
+        """Fractal field over the frame at these offsets, as (len(y_coords), len(x_coords)) float32"""
+        self.octaves_computed = self.octaves_reused = 0
+        total = None
+        amplitude = 1.0
+        norm = 0.0
+        for octave in range(self.octaves):
+            frequency = self.lacunarity ** octave
+            if min(self.x_scale, self.y_scale) / frequency >= self.REUSE_SAMPLES:
+                layer = self.low_octave(octave, frequency, len(x_coords), len(y_coords),
+                                        xoffset, yoffset, zoffset)
+            else:
+                layer = pnoise3_grid((x_coords + xoffset) * frequency,
+                                     (y_coords + yoffset) * frequency, zoffset * frequency)
+                self.octaves_computed += 1
+            
+            if self.mode == "turbulence":
+                layer = np.abs(layer)
+            elif self.mode == "ridged":
+                layer = 1 - np.abs(layer)
+                layer *= layer
+            if total is None:
+                total = layer * np.float32(amplitude)
+            else:
+                total += layer * np.float32(amplitude)
+            norm += amplitude
+            amplitude *= self.persistence
+        total /= np.float32(norm)
+        return total
+    
+    def low_octave(self, octave, frequency, ncols, nrows, xoffset, yoffset, zoffset):
+        """A low octave, shifted from when it was last sampled while the view is within a cell of it"""
+        margin_cols = int(np.ceil(self.x_scale / frequency))
+        margin_rows = int(np.ceil(self.y_scale / frequency))
+        entry = self.kept.get(octave)
+        if entry is not None:
+            x, y, z, field = entry
+            shift_x = (xoffset - x) * self.x_scale + margin_cols
+            shift_y = (yoffset - y) * self.y_scale + margin_rows
+            if (z == zoffset and field.shape == (nrows + 2 * margin_rows, ncols + 2 * margin_cols)
+                    and abs(xoffset - x) * frequency < 1 and abs(yoffset - y) * frequency < 1):
+                # Every cell moves by the same fraction of a sample, so the
+                # bilinear weights are scalars
+                left, top = int(np.floor(shift_x)), int(np.floor(shift_y))
+                fx, fy = np.float32(shift_x - left), np.float32(shift_y - top)
+                block = field[top:top + nrows + 1, left:left + ncols + 1]
+                upper = block[:-1, :-1] + (block[:-1, 1:] - block[:-1, :-1]) * fx
+                lower = block[1:, :-1] + (block[1:, 1:] - block[1:, :-1]) * fx
+                upper += (lower - upper) * fy
+                self.octaves_reused += 1
+                return upper
+        
+        xs = (np.arange(-margin_cols, ncols + margin_cols) / self.x_scale + xoffset) * frequency
+        ys = (np.arange(-margin_rows, nrows + margin_rows) / self.y_scale + yoffset) * frequency
+        field = pnoise3_grid(xs, ys, zoffset * frequency)
+        self.kept[octave] = (xoffset, yoffset, zoffset, field)
+        self.octaves_computed += 1
+        return field[margin_rows:margin_rows + nrows, margin_cols:margin_cols + ncols]
+
+class TileCache:
+    """LRU cache of tile x tile float32 blocks of samples on the exact sampling lattice"""
+    
+    def __init__(self, x_scale, y_scale, budget_bytes=16 * 1024 * 1024, tile=32):
+        self.x_scale = x_scale
+        self.y_scale = y_scale
+        self.budget_bytes = budget_bytes
+        self.tile = tile
+        self.tiles = OrderedDict()  # (tile x, tile y, z) -> samples, least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.samples_computed = 0
+    
+    def get(self, tx, ty, z):
+        key = (tx, ty, z)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return tile
+        
+        self.misses += 1
+        size = self.tile
+        # Same coordinates lattice_samples() would use, so cached values are exact
+        xs = (np.arange(size) + tx * size) / self.x_scale
+        ys = (np.arange(size) + ty * size) / self.y_scale
+        tile = pnoise3_grid(xs, ys, z)
+        self.samples_computed += tile.size
+        self.tiles[key] = tile
+        self.bytes += tile.nbytes
+        while self.bytes > self.budget_bytes and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.bytes -= old.nbytes
+            self.evictions += 1
+        return tile
+    
+    def region(self, lx, ly, ncols, nrows, z):
+        """Samples for an nrows x ncols block whose top-left cell sits at lattice (lx, ly)"""
+        size = self.tile
+        out = np.empty((nrows, ncols), dtype=np.float32)
+        for ty in range(ly // size, (ly + nrows - 1) // size + 1):
+            top = max(ly, ty * size)
+            bottom = min(ly + nrows, (ty + 1) * size)
+            for tx in range(lx // size, (lx + ncols - 1) // size + 1):
+                left = max(lx, tx * size)
+                right = min(lx + ncols, (tx + 1) * size)
+                tile = self.get(tx, ty, z)
+                out[top - ly:bottom - ly, left - lx:right - lx] = \
+                    tile[top - ty * size:bottom - ty * size, left - tx * size:right - tx * size]
+        return out
+
+class NoiseVolume:
+    """A baked tileable noise volume (see bake_volume.py), sampled by wrap-around trilinear lookup
+    
+    The .npy is memory-mapped read-only, so only the rows a frame touches are paged
+    in and every instance on the host shares them through the page cache.
+    """
+    
+    def __init__(self, path, density=10):
+        self.data = np.load(path, mmap_mode='r')
+        if self.data.ndim != 3 or self.data.dtype != np.float32:
+            raise ValueError(f"{path} is not a float32 (z, y, x) noise volume")
+        self.density = density  # samples per noise unit along every axis, as baked
+        self.nz, self.ny, self.nx = self.data.shape
+    
+    def axis(self, coords, n):
+        """Lower sample index, upper sample index (wrapped) and weight along one axis"""
+        position = np.mod(np.asarray(coords, dtype=np.float64) * self.density, n)
+        lower = np.floor(position)
+        weight = (position - lower).astype(np.float32)
+        lower = lower.astype(np.intp) % n  # position can round up to n itself
+        return lower, (lower + 1) % n, weight
+    
+    def sample(self, xs, ys, z):
+        """Field over every (ys[row], xs[col], z), like pnoise3_grid; returns float32"""
+        x0, x1, wx = self.axis(xs, self.nx)
+        y0, y1, wy = self.axis(ys, self.ny)
+        z0, z1, wz = self.axis(z, self.nz)
+        wy = wy[:, None]
+        
+        planes = []
+        for k in (int(z0), int(z1)):
+            # Whole rows in two gathers, then the columns out of them
+            plane = self.data[k]
+            rows = np.asarray(plane[y0])
+            rows += (plane[y1] - rows) * wy
+            field = rows[:, x0]
+            field += (rows[:, x1] - field) * wx
+            planes.append(field)
+        lower, upper = planes
+        lower += (upper - lower) * wz
+        return lower
+
+class Palette:
+    """256-entry RGB lookup table from uint8 noise values to cell colours"""
+    
+    # Built-in gradients as (value, (r, g, b)) control points, linearly interpolated
+    GRADIENTS = {
+        "grey": [(0, (0, 0, 0)), (255, (255, 255, 255))],
+        "fire": [(0, (0, 0, 0)), (96, (160, 16, 0)), (176, (255, 128, 0)),
+                 (232, (255, 224, 64)), (255, (255, 255, 224))],
+        "ocean": [(0, (0, 8, 32)), (112, (0, 64, 128)), (192, (0, 160, 192)),
+                  (255, (224, 255, 255))],
+        "terrain": [(0, (0, 0, 96)), (100, (0, 96, 192)), (110, (224, 208, 128)),
+                    (130, (32, 128, 32)), (200, (96, 80, 48)), (240, (200, 200, 200)),
+                    (255, (255, 255, 255))],
+    }
+    # "classic" is the original red = val, green = 255 - val, blue cycling with the frame
+    NAMES = ("classic",) + tuple(GRADIENTS)
+    
+    def __init__(self, name="classic"):
+        self.name = name
+        self.lut = np.zeros((256, 3), dtype=np.uint8)
+        self.version = 0  # bumped on every change, so encoders know to rebuild their tables
+        self.rg_version = 0  # bumped only when red or green change
+        self.blue = None
+        if name == "classic":
+            self.lut[:, 0] = np.arange(256)
+            self.lut[:, 1] = 255 - np.arange(256)
+        else:
+            points = self.GRADIENTS[name]
+            positions = [value for value, _ in points]
+            for channel in range(3):
+                levels = [rgb[channel] for _, rgb in points]
+                self.lut[:, channel] = np.round(np.interp(np.arange(256), positions, levels))
+        self.set_lengths()
+    
+    def update(self, framecount):
+        """Move to this frame; only the classic scheme changes, and only when its blue does"""
+        if self.name != "classic":
+            return
+        blue = framecount % 255
+        if blue == self.blue:
+            return
+        self.lut[:, 2] = blue
+        self.blue = blue
+        self.set_lengths()
+        self.version += 1
+    
+    def set_lengths(self):
+        # Length of "\x1B[48;2;r;g;bm" per entry, for the uncoalesced byte count
+        digits = 1 + (self.lut >= 10).astype(np.intp) + (self.lut >= 100)
+        self.sgr_lengths = 10 + digits.sum(axis=1)
+    
+    def colour(self, vals, out):
+        """RGB of every value, in one lookup, into out"""
+        np.take(self.lut, vals, axis=0, out=out, mode='clip')
+
+HALF_BLOCK = "\u2580"
+
+def reshape_buffer(array, shape):
+    """View array's storage with a new shape, allocating (with headroom) only when it must grow"""
+    base = array if array.base is None else array.base
+    size = int(np.prod(shape))
+    if base.size < size:
+        base = np.empty(size + size // 2, dtype=array.dtype)
+    return base.reshape(-1)[:size].reshape(shape)
+
+def fill_run_tokens(tokens, vals, table, repeat):
+    """Look up every cell's escape in table, using repeat where a cell matches its left neighbour"""
+    np.take(table, vals, out=tokens, mode='clip')
+    np.copyto(tokens[:, 1:], repeat, where=vals[:, 1:] == vals[:, :-1])
 
 class OptimizedNoiseRenderer:
-    def __init__(self, width, height):
+    def __init__(self, width, height, snap_to_lattice=False, quantize=1, half_block=False,
+                 noise_pool=None, upscale="bilinear", z_keyframe=0.0, volume=None,
+                 cache_bytes=16 * 1024 * 1024, fractal=None, palette=None):
         self.width = width
         self.height = height
         
-        # Smart caching only for static/repeated patterns
-        self.enable_cache = True
-        self.noise_cache = {}
-        self.cache_max_size = 2000  # Smaller cache for better performance
-        self.cache_hits = 0
-        self.cache_misses = 0
+        # Half-block mode draws "▀" with the upper sample as foreground and the
+        # lower one as background, so every cell carries two rows of samples
+        self.half_block = half_block
+        self.rows = height * 2 if half_block else height
         
         # Pre-allocate output buffers 
         self.output_parts = []
@@ -73,221 +791,1240 @@ class OptimizedNoiseRenderer:
         self.escape_start = "\x1B[48;2;"
         self.escape_end = "m "
         
+        # Run-length coalescing: one SGR per run of equal colours, optionally
+        # snapping values to multiples of quantize so runs get longer
+        self.quantize = quantize
+        self.bytes_uncoalesced = 0
+        self.bytes_encoded = 0
+        
+        # Colour stage between noise and encoding: values go through the palette
+        # LUT, and the tables of 256 full SGRs follow the palette's version
+        self.palette = palette if palette is not None else Palette()
+        self.sgr_table = np.empty(256, dtype=object)
+        self.fg_table = np.empty(256, dtype=object)
+        self.sgr_table_version = None
+        self.sgr_prefix_version = None
+        if half_block:
+            # fg SGR, bg SGR and the block itself per cell
+            self.cell_tokens = np.empty((height, width, 3), dtype=object)
+            self.cell_tokens[..., 2] = HALF_BLOCK
+        else:
+            self.cell_tokens = np.empty((height, width), dtype=object)
+        
         # For vectorized operations
         self.last_frame_time = 0
+        self.x_scale = 10  # cells per noise unit along x
+        self.y_scale = 10 if half_block else 5  # sample rows per noise unit along y
+        self.x_coords = np.arange(width) / self.x_scale
+        self.y_coords = np.arange(self.rows) / self.y_scale
+        self.field_min = 0.0
+        self.field_max = 0.0
+        self.samples_computed = 0
         
-    def get_noise_optimized(self, x, y, z):
-        """Optimized noise calculation with selective caching"""
-        if not self.enable_cache:
-            return float(pnoise3(x, y, z))
-            
-        # Only cache if coordinates are "round enough" to get cache hits
-        # Round to 1 decimal place for better hit ratio vs cache size
-        key = (round(x, 1), round(y, 1), round(z, 1))
+        # Lattice samples (the --snap strips) go through a tile cache, so panning
+        # back over ground already seen costs nothing; 0 bytes turns it off
+        self.tile_cache = TileCache(self.x_scale, self.y_scale, cache_bytes) if cache_bytes else None
+        
+        # Adaptive quality: at scale N only every Nth cell and row is sampled and
+        # the rest is filled in by "nearest" or "bilinear" upscaling
+        self.scale = 1
+        self.upscale = upscale
+        self.upscale_key = None
+        
+        # Baked volume to look samples up in instead of computing them
+        self.volume = volume
+        
+        # Multi-octave field (FractalNoise) in place of single-octave noise
+        self.fractal = fractal
         
-        if key in self.noise_cache:
-            self.cache_hits += 1
-            return self.noise_cache[key]
+        # Temporal keyframes: full slices only every z_keyframe along z
+        self.keyframes = ZKeyframes(z_keyframe, self.x_scale, self.y_scale) if z_keyframe else None
         
-        # Calculate noise value
-        value = float(pnoise3(x, y, z))
-        self.cache_misses += 1
+        # Optional multi-process backend for full-frame sampling; it outlives
+        # renderers, so a resize only sends it the new layout
+        self.noise_pool = noise_pool
+        if noise_pool:
+            noise_pool.set_layout(width, self.rows, self.x_scale, self.y_scale)
         
-        # Manage cache size more aggressively
-        if len(self.noise_cache) >= self.cache_max_size:
-            # Remove half the cache when full (keeps most recent)
-            items_to_remove = list(self.noise_cache.keys())[:self.cache_max_size // 2]
-            for k in items_to_remove:
-                del self.noise_cache[k]
+        # Scroll reuse: offsets snap to whole cells so the previous frame's
+        # samples can be kept in a ring buffer and only exposed edges computed
+        self.snap_to_lattice = snap_to_lattice
+        self.ring = np.zeros((self.rows, width), dtype=np.float32)
+        self.ring_row = 0
+        self.ring_col = 0
+        self.ring_origin = None  # (lattice x, lattice y, z) of the ring contents
+        self.frame = np.zeros((self.rows, width), dtype=np.float32)
         
-        self.noise_cache[key] = value
-        return value
+        # Per-cell RGB of the last rendered frame, for damage tracking
+        # (upper then lower sample in half-block mode)
+        self.colours = np.zeros((height, width, 6 if half_block else 3), dtype=np.uint8)
+    
+    def resize(self, width, height):
+        """Adopt a new terminal size, reusing buffers, escape tables and caches"""
+        old_rows, old_width = self.rows, self.width
+        self.width = width
+        self.height = height
+        self.rows = height * 2 if self.half_block else height
+        
+        if self.half_block:
+            self.cell_tokens = reshape_buffer(self.cell_tokens, (height, width, 3))
+            self.cell_tokens[..., 2] = HALF_BLOCK
+        else:
+            self.cell_tokens = reshape_buffer(self.cell_tokens, (height, width))
+        self.colours = reshape_buffer(self.colours, (height, width, self.colours.shape[2]))
+        self.x_coords = np.arange(width) / self.x_scale
+        self.y_coords = np.arange(self.rows) / self.y_scale
+        if self.noise_pool:
+            self.noise_pool.set_layout(width, self.rows, self.x_scale, self.y_scale)
+        
+        # The last frame is unwrapped in self.frame: keep its overlap with the
+        # new size and only sample the strips that were not on screen before
+        keep_rows, keep_cols = min(old_rows, self.rows), min(old_width, width)
+        kept = self.frame[:keep_rows, :keep_cols].copy() if self.ring_origin else None
+        self.ring = reshape_buffer(self.ring, (self.rows, width))
+        self.frame = reshape_buffer(self.frame, (self.rows, width))
+        self.ring_row = self.ring_col = 0
+        if kept is not None:
+            lx, ly, zoffset = self.ring_origin
+            self.ring[:keep_rows, :keep_cols] = kept
+            if width > keep_cols:
+                self.ring[:keep_rows, keep_cols:] = self.lattice_samples(
+                    lx + keep_cols, ly, width - keep_cols, keep_rows, zoffset)
+            if self.rows > keep_rows:
+                self.ring[keep_rows:] = self.lattice_samples(
+                    lx, ly + keep_rows, width, self.rows - keep_rows, zoffset)
+        
+    def sample_field(self, xoffset, yoffset, zoffset):
+        """Noise samples for the frame at the given offsets, as (height, width) float32"""
+        if self.volume is not None:
+            self.samples_computed = 0
+            return self.volume.sample(self.x_coords + xoffset, self.y_coords + yoffset, zoffset)
+        
+        if self.fractal is not None:
+            field = self.fractal.sample(self.x_coords, self.y_coords, xoffset, yoffset, zoffset)
+            self.samples_computed = self.fractal.octaves_computed * self.width * self.rows
+            return field
+        
+        if self.scale > 1:
+            # The ring holds full-resolution samples, so it starts over at scale 1
+            self.ring_origin = None
+            return self.sample_scaled(xoffset, yoffset, zoffset)
+        
+        if self.keyframes:
+            # Keyframes are laid out on the lattice, so panning moves in whole cells
+            lx = round(xoffset * self.x_scale)
+            ly = round(yoffset * self.y_scale)
+            field = self.keyframes.sample(lx, ly, zoffset, self.width, self.rows)
+            self.samples_computed = self.keyframes.samples_computed
+            return field
+        
+        if not self.snap_to_lattice:
+            # Whole frame of noise in one batched call instead of width*height pnoise3 calls
+            self.samples_computed = self.width * self.rows
+            if self.noise_pool:
+                return self.noise_pool.sample(xoffset, yoffset, zoffset)
+            return pnoise3_grid(self.x_coords + xoffset, self.y_coords + yoffset, zoffset)
+        
+        lx = round(xoffset * self.x_scale)
+        ly = round(yoffset * self.y_scale)
+        return self.scroll_ring(lx, ly, zoffset)
+    
+    def sample_scaled(self, xoffset, yoffset, zoffset):
+        """Sample every scale-th cell and row, then upscale to the full frame"""
+        s = self.scale
+        if self.upscale_key != (s, self.width, self.rows):
+            self.set_upscale_indices()
+        
+        # One sample past the right and bottom edges so every cell has neighbours
+        ncols = (self.width - 1) // s + 2
+        nrows = (self.rows - 1) // s + 2
+        xs = np.arange(ncols) * (s / self.x_scale) + xoffset
+        ys = np.arange(nrows) * (s / self.y_scale) + yoffset
+        coarse = pnoise3_grid(xs, ys, zoffset)
+        self.samples_computed = coarse.size
+        
+        if self.upscale == "nearest":
+            return coarse[self.nearest_rows][:, self.nearest_cols]
+        rows = coarse[self.lower_rows]
+        rows += (coarse[self.lower_rows + 1] - rows) * self.row_weights
+        field = rows[:, self.lower_cols]
+        field += (rows[:, self.lower_cols + 1] - field) * self.col_weights
+        return field
+    
+    def set_upscale_indices(self):
+        s = self.scale
+        cols = np.arange(self.width)
+        rows = np.arange(self.rows)
+        self.nearest_cols = (cols + s // 2) // s
+        self.nearest_rows = (rows + s // 2) // s
+        self.lower_cols = cols // s
+        self.lower_rows = rows // s
+        self.col_weights = ((cols % s) / s).astype(np.float32)
+        self.row_weights = ((rows % s) / s).astype(np.float32)[:, None]
+        self.upscale_key = (s, self.width, self.rows)
+    
+    def lattice_samples(self, lx, ly, ncols, nrows, zoffset, cached=True):
+        """Samples for an nrows x ncols block whose top-left cell sits at lattice (lx, ly)"""
+        if cached and self.tile_cache:
+            computed = self.tile_cache.samples_computed
+            block = self.tile_cache.region(lx, ly, ncols, nrows, zoffset)
+            self.samples_computed += self.tile_cache.samples_computed - computed
+            return block
+        xs = (np.arange(ncols) + lx) / self.x_scale
+        ys = (np.arange(nrows) + ly) / self.y_scale
+        self.samples_computed += ncols * nrows
+        return pnoise3_grid(xs, ys, zoffset)
+    
+    def scroll_ring(self, lx, ly, zoffset):
+        """Move the ring buffer to lattice (lx, ly), computing only the newly exposed strips"""
+        width, height = self.width, self.rows
+        self.samples_computed = 0
+        
+        if self.ring_origin is None:
+            dx = dy = None
+        else:
+            old_x, old_y, old_z = self.ring_origin
+            dx, dy = lx - old_x, ly - old_y
+        
+        if dx is None or old_z != zoffset or abs(dx) >= width or abs(dy) >= height:
+            # Nothing reusable: fill the ring from scratch. A new z slice every
+            # frame would only churn the tile cache, so that goes around it
+            z_moved = dx is not None and old_z != zoffset
+            self.ring[:] = self.lattice_samples(lx, ly, width, height, zoffset, cached=not z_moved)
+            self.ring_row = self.ring_col = 0
+        else:
+            self.ring_col = (self.ring_col + dx) % width
+            self.ring_row = (self.ring_row + dy) % height
+            
+            if dx:
+                # Columns that scrolled off are recycled for the exposed side
+                first = width - dx if dx > 0 else 0
+                cols = (self.ring_col + np.arange(first, first + abs(dx))) % width
+                strip = self.lattice_samples(lx + first, ly, abs(dx), height, zoffset)
+                self.ring[:, cols] = np.roll(strip, self.ring_row, axis=0)
+            if dy:
+                first = height - dy if dy > 0 else 0
+                rows = (self.ring_row + np.arange(first, first + abs(dy))) % height
+                strip = self.lattice_samples(lx, ly + first, width, abs(dy), zoffset)
+                self.ring[rows, :] = np.roll(strip, self.ring_col, axis=1)
+        
+        self.ring_origin = (lx, ly, zoffset)
+        
+        # Unwrap the ring into frame order with four block copies
+        r0, c0 = self.ring_row, self.ring_col
+        ring, frame = self.ring, self.frame
+        frame[:height - r0, :width - c0] = ring[r0:, c0:]
+        frame[:height - r0, width - c0:] = ring[r0:, :c0]
+        frame[height - r0:, :width - c0] = ring[:r0, c0:]
+        frame[height - r0:, width - c0:] = ring[:r0, :c0]
+        return frame
     
     def render_frame_fast(self, xoffset, yoffset, zoffset, mx, b, framecount):
         """Highly optimized frame rendering focused on real bottlenecks"""
+        vals, palette = self.render_values(xoffset, yoffset, zoffset, mx, b, framecount)
+        return self.encode_frame(vals, palette)
+    
+    def render_values(self, xoffset, yoffset, zoffset, mx, b, framecount):
+        """Sample, scale and colour a frame; returns its (rows, width) uint8 values and the palette"""
+        field = self.sample_field(xoffset, yoffset, zoffset)
+        return self.colour_field(field, mx, b, framecount)
+    
+    def colour_field(self, field, mx, b, framecount):
+        """Scale a sampled field to uint8 values and colour them; returns the values and the palette"""
+        self.field_min = float(field.min())
+        self.field_max = float(field.max())
+        
+        # Scale and clamp in bulk, then hand plain ints to the encoder
+        vals = np.clip(field * mx + b, 0, 255).astype(np.uint8)
+        if self.quantize > 1:
+            vals //= self.quantize
+            vals *= self.quantize
+        palette = self.palette
+        palette.update(framecount)
+        sgr_bytes = int(palette.sgr_lengths[vals].sum())
+        
+        if self.half_block:
+            # Upper and lower samples of each cell side by side, coloured in one lookup
+            pairs = vals.reshape(self.height, 2, self.width).transpose(0, 2, 1)
+            palette.colour(pairs, self.colours.reshape(self.height, self.width, 2, 3))
+            # fg + bg SGR and a 3-byte block for every cell
+            self.bytes_uncoalesced = sgr_bytes + self.width * self.height * 3
+            return vals, palette
+        
+        palette.colour(vals, self.colours)
+        # What one SGR + space per cell would cost, for comparison with the encoders
+        self.bytes_uncoalesced = sgr_bytes + vals.size
+        return vals, palette
+    
+    def set_table_palette(self, palette):
+        if (palette, palette.version) == self.sgr_table_version:
+            return
+        # The "r;g;" part is kept while only blue changes, as it does every frame
+        # in the classic palette
+        if (palette, palette.rg_version) != self.sgr_prefix_version:
+            rgs = [f"{r};{g};" for r, g in palette.lut[:, :2].tolist()]
+            self.sgr_prefixes = [self.escape_start + rg for rg in rgs]
+            self.fg_prefixes = ["\x1B[38;2;" + rg for rg in rgs]
+            self.sgr_prefix_version = (palette, palette.rg_version)
+        
+        # Half-block cells end in the block, full cells in a space
+        end = "m" if self.half_block else self.escape_end
+        suffixes = [f"{b}{end}" for b in palette.lut[:, 2].tolist()]
+        self.sgr_table[:] = [prefix + suffix for prefix, suffix in zip(self.sgr_prefixes, suffixes)]
+        if self.half_block:
+            self.fg_table[:] = [prefix + suffix for prefix, suffix in zip(self.fg_prefixes, suffixes)]
+        self.sgr_table_version = (palette, palette.version)
+    
+    def encode_frame(self, vals, palette):
+        """Encode a frame of uint8 values into one escape string per line"""
         self.output_parts.clear()
+        self.set_table_palette(palette)
         
-        # Batch process pixels and minimize function calls
-        for y in range(self.height):
-            ypos = y/5 + yoffset
-            
-            # Build line in one go 
-            line_parts = []
-            for x in range(self.width):
-                xpos = x/10 + xoffset
-                
-                # Direct noise calculation (avoid caching overhead for simple cases)
-                noiseval = self.get_noise_optimized(xpos, ypos, zoffset)
-                val = int(noiseval * mx + b)
-                
-                # Clamp efficiently
-                if val < 0:
-                    val = 0
-                elif val > 255:
-                    val = 255
-                
-                # Build escape sequence directly
-                r, g, b_color = val, 255-val, framecount % 255
-                line_parts.append(f"{self.escape_start}{r};{g};{b_color}{self.escape_end}")
-            
-            self.output_parts.append(''.join(line_parts))
+        # Gather every cell's escape from the tables in one go; cells that
+        # continue a run of the same colour only need their space (or block)
+        tokens = self.cell_tokens
+        if self.half_block:
+            fill_run_tokens(tokens[..., 0], vals[0::2], self.fg_table, '')
+            fill_run_tokens(tokens[..., 1], vals[1::2], self.sgr_table, '')
+            tokens = tokens.reshape(self.height, -1)
+        else:
+            fill_run_tokens(tokens, vals, self.sgr_table, ' ')
         
+        for row in tokens.tolist():
+            self.output_parts.append(''.join(row))
+        
+        self.bytes_encoded = sum(map(len, self.output_parts))
+        if self.half_block:
+            self.bytes_encoded += 2 * self.width * self.height  # "▀" is 3 bytes of UTF-8
         return self.output_parts
     
     def get_cache_stats(self):
-        total = self.cache_hits + self.cache_misses
-        hit_ratio = (self.cache_hits / total * 100) if total > 0 else 0
-        return hit_ratio, len(self.noise_cache)
+        """Tile cache hit ratio (%), tiles held, hits, misses and evictions"""
+        cache = self.tile_cache
+        if not cache:
+            return 0, 0, 0, 0, 0
+        total = cache.hits + cache.misses
+        hit_ratio = (cache.hits / total * 100) if total > 0 else 0
+        return hit_ratio, len(cache.tiles), cache.hits, cache.misses, cache.evictions
+    
+    def get_encode_stats(self):
+        return self.bytes_uncoalesced, self.bytes_encoded
+
+# Decimal digits of 0..255 as bytes, so escapes can be assembled without str formatting
+DIGIT_BYTES = [str(i).encode() for i in range(256)]
+
+def write_all(fd, data):
+    """os.write() all of data, resuming after partial writes"""
+    view = memoryview(data)
+    while view:
+        try:
+            written = os.write(fd, view)
+        except BlockingIOError:
+            select.select([], [fd], [])
+            continue
+        view = view[written:]
+
+class ByteFrameEncoder:
+    """Joins header and frame tokens into the bytes handed to os.write, bypassing sys.stdout"""
+    
+    ROW_END = b"\x1B[1E"
+    
+    def __init__(self, renderer):
+        width, height = renderer.width, renderer.height
+        self.width = width
+        self.height = height
+        self.half_block = renderer.half_block
+        
+        # Byte tables of the 256 SGRs per val; full cells end in a space, which is
+        # also the token for a cell continuing a run, half-block cells in nothing
+        self.escape_start = renderer.escape_start.encode()
+        self.escape_end = b"m" if self.half_block else renderer.escape_end.encode()
+        self.repeat = b"" if self.half_block else b" "
+        self.table = np.empty(256, dtype=object)
+        self.fg_table = np.empty(256, dtype=object)
+        self.table_version = None
+        self.prefix_version = None
+        
+        # Per-frame scratch, allocated once; the last column is always ROW_END
+        self.tokens = np.empty((height, width + 1, 3) if self.half_block else (height, width + 1),
+                               dtype=object)
+        self.frame = b""
+        self.frame_size = 0
+        self.resize(width, height)
+    
+    def resize(self, width, height):
+        """Reshape the token scratch in place"""
+        self.width = width
+        self.height = height
+        if self.half_block:
+            self.tokens = reshape_buffer(self.tokens, (height, width + 1, 3))
+            self.tokens[:, :-1, 2] = HALF_BLOCK.encode()
+            self.tokens[:, -1] = [self.ROW_END, b"", b""]
+        else:
+            self.tokens = reshape_buffer(self.tokens, (height, width + 1))
+            self.tokens[:, -1] = self.ROW_END
+    
+    def set_palette(self, palette):
+        """Rebuild the SGR tables from the digit tables when the palette changes"""
+        if (palette, palette.version) == self.table_version:
+            return
+        digits = DIGIT_BYTES
+        if (palette, palette.rg_version) != self.prefix_version:
+            rgs = [digits[r] + b";" + digits[g] + b";" for r, g in palette.lut[:, :2].tolist()]
+            self.prefixes = [self.escape_start + rg for rg in rgs]
+            self.fg_prefixes = [b"\x1B[38;2;" + rg for rg in rgs]
+            self.prefix_version = (palette, palette.rg_version)
+        
+        suffixes = [digits[b] + self.escape_end for b in palette.lut[:, 2].tolist()]
+        self.table[:] = [prefix + suffix for prefix, suffix in zip(self.prefixes, suffixes)]
+        if self.half_block:
+            fg_suffixes = [digits[b] + b"m" for b in palette.lut[:, 2].tolist()]
+            self.fg_table[:] = [prefix + suffix for prefix, suffix in zip(self.fg_prefixes, fg_suffixes)]
+        self.table_version = (palette, palette.version)
+    
+    def encode(self, header, vals, palette):
+        """Encode header bytes plus a frame of uint8 values; returns the frame as bytes"""
+        self.set_palette(palette)
+        
+        tokens = self.tokens
+        if self.half_block:
+            fill_run_tokens(tokens[:, :-1, 0], vals[0::2], self.fg_table, self.repeat)
+            fill_run_tokens(tokens[:, :-1, 1], vals[1::2], self.table, self.repeat)
+        else:
+            fill_run_tokens(tokens[:, :-1], vals, self.table, self.repeat)
+        
+        # The header rides on the first token, so the whole frame is built by one join
+        parts = tokens.ravel().tolist()
+        parts[0] = header + parts[0]
+        self.frame = b''.join(parts)
+        self.frame_size = len(self.frame) - len(header)
+        return self.frame
+
+class FrameDiffer:
+    """Turns a rendered frame into cursor-addressed updates for the cells that changed"""
+    
+    def __init__(self, width, height, threshold=0, top=2, half_block=False):
+        self.width = width
+        self.height = height
+        self.half_block = half_block  # colours hold upper + lower RGB per cell
+        self.threshold = threshold  # per-channel change that is still considered "unchanged"
+        self.top = top  # screen row (1-based) of the first frame line
+        self.shown = None  # colours last emitted per cell, None until the first full repaint
+        self.cells_changed = 0
+        self.full_repaints = 0
+    
+    def encode(self, colours, full_size):
+        """Return the diff for this frame, or None when a full repaint of full_size bytes is cheaper"""
+        if self.shown is None:
+            return self.full_repaint(colours)
+        
+        delta = np.abs(colours.astype(np.int16) - self.shown).max(axis=2)
+        changed = delta > self.threshold
+        self.cells_changed = int(np.count_nonzero(changed))
+        if not self.cells_changed:
+            return ""
+        
+        # Run boundaries per row: every run costs one cursor move on top of its cells
+        padded = np.zeros((self.height, self.width + 2), dtype=np.int8)
+        padded[:, 1:-1] = changed
+        edges = np.diff(padded, axis=1)
+        run_rows, run_starts = np.nonzero(edges == 1)
+        run_ends = np.nonzero(edges == -1)[1]
+        
+        per_cell = full_size / (self.width * self.height)
+        if self.cells_changed * per_cell + len(run_starts) * 9 >= full_size:
+            return self.full_repaint(colours)
+        
+        parts = []
+        for row, start, end in zip(run_rows.tolist(), run_starts.tolist(), run_ends.tolist()):
+            parts.append(f"\x1B[{row + self.top};{start + 1}H")
+            if self.half_block:
+                self.encode_half_blocks(parts, colours[row, start:end].tolist())
+                continue
+            last = None
+            for cell in colours[row, start:end].tolist():
+                if cell != last:
+                    parts.append(f"\x1B[48;2;{cell[0]};{cell[1]};{cell[2]}m")
+                    last = cell
+                parts.append(" ")
+        
+        self.shown[changed] = colours[changed]
+        return ''.join(parts)
+    
+    def encode_half_blocks(self, parts, cells):
+        """Append blocks for a run of cells, emitting fg/bg only when they change"""
+        fg = bg = None
+        for r1, g1, b1, r2, g2, b2 in cells:
+            if (r1, g1, b1) != fg:
+                fg = (r1, g1, b1)
+                parts.append(f"\x1B[38;2;{r1};{g1};{b1}m")
+            if (r2, g2, b2) != bg:
+                bg = (r2, g2, b2)
+                parts.append(f"\x1B[48;2;{r2};{g2};{b2}m")
+            parts.append(HALF_BLOCK)
+    
+    def full_repaint(self, colours):
+        self.shown = colours.astype(np.int16)
+        self.cells_changed = self.width * self.height
+        self.full_repaints += 1
+        return None
+    
+    def reset(self):
+        """Forget what is on screen so the next frame is a full repaint"""
+        self.shown = None
+    
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.reset()
+
+class FramePipeline:
+    """Double-buffered output stage: frame N is written on a thread while N+1 is built"""
+    
+    def __init__(self, fd, renderer):
+        self.fd = fd
+        self.cond = threading.Condition()
+        self.free = [ByteFrameEncoder(renderer), ByteFrameEncoder(renderer)]
+        self.queued = None  # (encoder, data) handed off but not yet picked up by the writer
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="frame-writer", daemon=True)
+        self.thread.start()
+    
+    def acquire(self):
+        """An encoder whose buffer is free to fill, reclaiming the queued frame if need be;
+        returns (encoder, dropped) so a diff is not built on the dropped frame"""
+        with self.cond:
+            if self.free:
+                return self.free.pop(), False
+            # One buffer is being written and the other still waits: drop the older frame
+            encoder, _ = self.queued
+            self.queued = None
+            self.frames_dropped += 1
+            return encoder, True
+    
+    def submit(self, encoder, data):
+        """Hand a frame to the writer; returns True if an unwritten frame was dropped for it,
+        in which case the full frame in encoder's buffer is sent in place of data"""
+        with self.cond:
+            dropped = self.queued is not None
+            if dropped:
+                self.free.append(self.queued[0])
+                self.frames_dropped += 1
+                # data may be a diff against the frame never written
+                data = encoder.frame
+            self.queued = (encoder, data)
+            self.cond.notify_all()
+        return dropped
+    
+    def run(self):
+        while True:
+            with self.cond:
+                while self.queued is None and not self.closed:
+                    self.cond.wait()
+                if self.queued is None:
+                    return
+                encoder, data = self.queued
+                self.queued = None
+            
+            # os.write releases the GIL, so the next frame is rendered meanwhile
+            write_all(self.fd, data)
+            
+            with self.cond:
+                self.free.append(encoder)
+                self.frames_written += 1
+                self.cond.notify_all()
+    
+    def drain(self):
+        """Wait until every handed-off frame is on its way out and both buffers are free"""
+        with self.cond:
+            while self.queued is not None or len(self.free) < 2:
+                self.cond.wait()
+    
+    def resize(self, width, height):
+        """Resize both buffers, dropping a queued frame that was built for the old size"""
+        with self.cond:
+            if self.queued is not None:
+                self.free.append(self.queued[0])
+                self.queued = None
+                self.frames_dropped += 1
+        self.drain()
+        for encoder in self.free:
+            encoder.resize(width, height)
+    
+    def close(self):
+        self.drain()
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+
+# kind is "motion", "wheel", "press", "release" or "key"; for keys button is the byte
+MouseEvent = namedtuple("MouseEvent", "kind button x y shift meta ctrl")
+
+class MouseParser:
+    """Incremental parser for SGR (1006) mouse reports and key bytes read from raw stdin"""
+    
+    REPORT = re.compile(rb"\x1b\[<(\d+);(\d+);(\d+)([Mm])")
+    # A tail that may still turn into a report once the rest of it is read
+    PARTIAL = re.compile(rb"\x1b(?:\[(?:<[\d;]*)?)?\Z")
+    MAX_PENDING = 32
+    
+    def __init__(self):
+        self.pending = b""
+        self.reports = 0
+        self.motions_dropped = 0
+    
+    def feed(self, data):
+        """Parse freshly read bytes; a burst of motion reports collapses to the newest one"""
+        buf = self.pending + data if self.pending else data
+        # split() interleaves the bytes between reports with each report's fields
+        parts = self.REPORT.split(buf)
+        events = []
+        motion = None
+        for i in range(0, len(parts) - 1, 5):
+            if parts[i]:
+                self.add_keys(events, parts[i])
+            cb = int(parts[i + 1])
+            if cb & 96 == 32:
+                # Motion (button 3 when nothing is held): only the newest one is built
+                if motion is not None:
+                    self.motions_dropped += 1
+                motion = (len(events), i + 1)
+                continue
+            if cb & 64:
+                kind = "wheel"  # button 0 up, 1 down, 2/3 sideways
+            elif parts[i + 4] == b"m":
+                kind = "release"
+            else:
+                kind = "press"
+            events.append(self.event(kind, cb, parts[i + 2], parts[i + 3]))
+        self.reports += len(parts) // 5
+        
+        if motion is not None:
+            at, field = motion
+            events.insert(at, self.event("motion", int(parts[field]),
+                                         parts[field + 1], parts[field + 2]))
+        
+        # Hold back a cut-off report until the next read completes it
+        tail = parts[-1]
+        partial = self.PARTIAL.search(tail)
+        if partial and len(tail) - partial.start() <= self.MAX_PENDING:
+            self.add_keys(events, tail[:partial.start()])
+            self.pending = tail[partial.start():]
+        else:
+            self.add_keys(events, tail)
+            self.pending = b""
+        return events
+    
+    @staticmethod
+    def event(kind, cb, x, y):
+        button = (cb & 3) + (8 if cb & 128 else 0)
+        return MouseEvent(kind, button, int(x), int(y), bool(cb & 4), bool(cb & 8), bool(cb & 16))
+    
+    @staticmethod
+    def add_keys(events, data):
+        for byte in data:
+            events.append(MouseEvent("key", byte, 0, 0, False, False, False))
+
+class FrameProfiler:
+    """cProfile plus a stack sampler on the frame loop's thread, started and stopped on demand"""
+    
+    SAMPLE_INTERVAL = 0.001  # seconds between stack samples for the collapsed file
+    SHOW_SAVED = 5.0  # seconds the header names the files after a capture
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.profile = None
+        self.sampling = threading.Event()
+        self.sampler = None
+        self.stacks = {}
+        self.started = 0.0
+        self.frames = 0
+        self.saved = None
+        self.saved_at = 0.0
+        self.error = None
+    
+    @property
+    def active(self):
+        return self.profile is not None
+    
+    def start(self):
+        self.stacks = {}
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.sampling.set()
+        self.sampler = threading.Thread(target=self.sample, args=(threading.get_ident(),),
+                                        daemon=True)
+        self.sampler.start()
+        # Enabled last so none of the setup above lands in the profile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+    
+    def sample(self, ident):
+        """Sampler thread: count the frame loop's current stack, root first"""
+        stacks = self.stacks
+        while self.sampling.is_set():
+            frame = sys._current_frames().get(ident)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack = ";".join(reversed(names))
+            stacks[stack] = stacks.get(stack, 0) + 1
+            time.sleep(self.SAMPLE_INTERVAL)
+    
+    def stop(self):
+        """Stop capturing and write <stamp>.pstats and <stamp>.collapsed; returns the path prefix,
+        or None if they could not be written (the reason is kept in self.error)"""
+        self.profile.disable()
+        self.sampling.clear()
+        self.sampler.join()
+        profile, self.profile = self.profile, None
+        self.saved_at = time.perf_counter()
+        
+        # Milliseconds too, so two captures in the same second keep separate files
+        now = time.time()
+        stamp = time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(now))
+        base = os.path.join(self.directory, f"{stamp}-{int(now * 1000) % 1000:03d}")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(base + ".pstats")
+            # One "root;...;leaf count" line per stack, as flamegraph.pl and speedscope read it
+            with open(base + ".collapsed", "w") as fh:
+                for stack, count in sorted(self.stacks.items()):
+                    fh.write(f"{stack} {count}\n")
+        except OSError as error:
+            # Reported in the header; an unwritable directory must not end the session
+            self.saved, self.error = None, str(error)
+            return None
+        self.saved, self.error = base, None
+        return base
+    
+    def toggle(self):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+    
+    def status(self):
+        """Header text: capture progress, or for a few seconds where the last one went"""
+        if self.active:
+            return f"PROFILING {time.perf_counter() - self.started:.1f}s {self.frames} frames (p stops) "
+        if time.perf_counter() - self.saved_at < self.SHOW_SAVED:
+            if self.error:
+                return f"Profile not saved: {self.error} "
+            return f"Saved {self.saved}.pstats/.collapsed "
+        return ""
 
 # Main application with performance optimizations
-signal.signal(signal.SIGINT, signal_handler)
-
-screen = curses.initscr()
-curses.curs_set(0)
-screen.keypad(1)
-curses.mouseinterval(0)
-curses.mousemask(curses.ALL_MOUSE_EVENTS)
-screen.nodelay(1)
-curses.noecho()
-curses.raw()
-curses.cbreak()
-
-# Optimized constants
-maxval = 255
-mx = 127.5
-b = 127.5
-
-width = 80
-height = 10
-
-height, width = screen.getmaxyx()
-height = height - 1  # Reserve top line for info
-
-fps = 30
-target_frame_time = 1.0 / fps
-
-z = 0
-minfound = 0.0
-maxfound = 0.0
-
-mousex = 0
-mousey = 0
-xoffset = 0
-yoffset = 0
-zoffset = 0
-xvelocity = 0.01
-yvelocity = 0.01
-zvelocity = 0
-
-# Initialize optimized renderer
-renderer = OptimizedNoiseRenderer(width, height)
-perf_monitor = PerformanceMonitor()
-
-# Open debug file only once
-fh = open("debug.txt", "w")
-
-# Enable mouse tracking
-sys.stdout.write("\x1B[?1003h\x1B[?1015h\x1B[?1006h")
-sys.stdout.flush()
-
-framecount = 0
-last_size_check = 0
-
-# Pre-allocate main output buffer
-main_output = []
-
-while True:
-    frame_start = time.time()
-    framecount += 1
-    
-    # Handle input efficiently
-    event = screen.getch()
-    
-    # Check screen size less frequently
-    if framecount - last_size_check > 30:
-        new_height, new_width = screen.getmaxyx()
-        new_height = new_height - 1
-        if new_width != width or new_height != height:
-            width, height = new_width, new_height
-            renderer = OptimizedNoiseRenderer(width, height)
-        last_size_check = framecount
-    
-    # Optimized input handling
-    instream = ""
-    if select.select([sys.stdin], [], [], 0)[0]:
-        instream = sys.stdin.read(1000)  # Read more at once
-    
-    # Parse mouse input efficiently 
-    if instream:
-        # Focus on most common mouse events only
-        parts = instream.replace("\x1b[<", "").split("M")
-        for part in parts:
-            if ";" in part:
-                try:
-                    elements = part.split(";")
-                    if len(elements) >= 3:
-                        if elements[0] == "35":
-                            mousex = int(elements[1])
-                            mousey = int(elements[2])
-                        elif elements[0] == "65":
-                            zvelocity -= 0.01
-                        elif elements[0] == "64":
-                            zvelocity += 0.01
-                except (ValueError, IndexError):
-                    continue
-    
-    if event == ord("q"):
-        break
-    
-    # Update positions (batch these calculations)
-    xcentre = width/2
-    ycentre = height/2
-    
-    # Simplified velocity calculations
-    xvelocity = (mousex - xcentre) * 0.001
-    yvelocity = (mousey - ycentre) * 0.001
-    
-    xoffset += xvelocity
-    yoffset += yvelocity
-    zoffset += zvelocity
-    
-    # Render frame with optimizations
-    frame_lines = renderer.render_frame_fast(xoffset, yoffset, zoffset, mx, b, framecount)
-    
-    # Build complete output in one buffer
-    main_output.clear()
-    main_output.append("\x1B[1;1H\x1B[0m")
-    
-    # Header with performance info
-    current_fps = perf_monitor.get_fps()
-    hit_ratio, cache_size = renderer.get_cache_stats()
-    header = f"Mouse: {mousex:3d},{mousey:3d} Vel: {xvelocity:.3f},{yvelocity:.3f},{zvelocity:.3f} FPS: {current_fps:.1f} Cache: {hit_ratio:.0f}%"
-    main_output.append(header)
-    main_output.append("\x1B[1E")
-    
-    # Add all frame lines
-    for line in frame_lines:
-        main_output.append(line)
-        main_output.append("\x1B[1E")
-    
-    # Single output operation
-    sys.stdout.write(''.join(main_output))
-    sys.stdout.flush()
+class NoiseApp:
+    """Visualiser state plus the per-frame steps that both runtimes drive"""
+    
+    # Velocities are per simulation step; steps run at the 30 Hz they were tuned
+    # for whatever rate frames are drawn at
+    SIM_DT = 1.0 / 30
+    MAX_CATCH_UP = 0.25  # seconds of backlog simulated at most, e.g. after a stall
+    
+    def __init__(self, screen, args):
+        self.screen = screen
+        self.args = args
+        
+        # Optimized constants
+        self.mx = 127.5
+        self.b = 127.5
+        
+        width, height = os.get_terminal_size(sys.stdout.fileno())
+        # Top line reserved for info; a pane shrunk to one row still gets a frame
+        # row (drawn over the header) rather than an empty frame
+        self.width = max(width, 1)
+        self.height = max(height - 1, 1)
+        
+        self.fps = args.fps
+        
+        self.mousex = 0
+        self.mousey = 0
+        self.xoffset = 0
+        self.yoffset = 0
+        self.zoffset = 0
+        self.xvelocity = 0.01
+        self.yvelocity = 0.01
+        self.zvelocity = 0
+        
+        # Fixed-timestep accumulator, and the offsets before the last step for interpolation
+        self.sim_time = None
+        self.sim_accumulator = 0.0
+        self.prev_offsets = (0, 0, 0)
+        
+        self.running = True
+        self.framecount = 0
+        self.resize_pending = False  # set by SIGWINCH, applied at the next frame boundary
+        self.bytes_out = 0
+        
+        # Pre-allocate main output buffer
+        self.main_output = []
+        
+        # Baked volume, mapped once and shared by every renderer
+        self.volume = NoiseVolume(args.volume, args.volume_density) if args.volume else None
+        
+        # Worker pool lives for the whole session, across resizes
+        self.noise_pool = None
+        if args.workers > 0:
+            self.noise_pool = NoiseWorkerPool(args.workers)
+            atexit.register(self.noise_pool.close)
+        
+        self.perf_monitor = PerformanceMonitor()
+        self.show_stats = args.stats
+        if args.stats:
+            self.perf_monitor.enable_stages()
+        self.stats_line = ""
+        self.profiler = FrameProfiler(args.profile_dir)
+        self.profile_toggle = False  # set by the p key, applied at the next frame boundary
+        self.scheduler = FrameScheduler(self.fps, self.perf_monitor)
+        self.quality = None
+        if args.adaptive:
+            self.quality = QualityController(self.perf_monitor, 1.0 / self.fps, args.max_scale)
+        self.stdin_fd = sys.stdin.fileno()
+        self.stdout_fd = sys.stdout.fileno()
+        self.mouse_parser = MouseParser()
+        self.differ = None
+        self.encoder = None
+        self.pipeline = None
+        
+        self.renderer = OptimizedNoiseRenderer(self.width, self.height, snap_to_lattice=args.snap,
+                                               quantize=args.quantize, half_block=args.half_block,
+                                               noise_pool=self.noise_pool, upscale=args.upscale,
+                                               z_keyframe=args.z_keyframe, volume=self.volume,
+                                               cache_bytes=int(args.cache_mb * 1024 * 1024),
+                                               fractal=self.fractal_noise(),
+                                               palette=Palette(args.palette))
+        if args.diff:
+            self.differ = FrameDiffer(self.width, self.height, args.diff_threshold,
+                                      half_block=args.half_block)
+        if not args.stdio:
+            self.encoder = ByteFrameEncoder(self.renderer)
+        if args.pipeline:
+            self.pipeline = FramePipeline(self.stdout_fd, self.renderer)
+    
+    def fractal_noise(self):
+        args = self.args
+        if not args.fractal:
+            return None
+        return FractalNoise(args.fractal, args.octaves, args.lacunarity, args.persistence,
+                            x_scale=10, y_scale=10 if args.half_block else 5)
+    
+    def on_winch(self, sig, frame):
+        """SIGWINCH handler: only note it, the frame loop applies the new size"""
+        self.resize_pending = True
+    
+    def check_resize(self):
+        """At a frame boundary, resize everything in place if SIGWINCH arrived since the last one"""
+        if not self.resize_pending:
+            return
+        self.resize_pending = False
+        # Straight from the tty: curses only refreshes getmaxyx() inside getch()
+        new_width, new_height = os.get_terminal_size(self.stdout_fd)
+        new_width, new_height = max(new_width, 1), max(new_height - 1, 1)
+        if new_width == self.width and new_height == self.height:
+            return
+        self.width, self.height = new_width, new_height
+        
+        self.renderer.resize(self.width, self.height)
+        if self.differ:
+            self.differ.resize(self.width, self.height)
+        if self.encoder:
+            self.encoder.resize(self.width, self.height)
+        if self.pipeline:
+            self.pipeline.resize(self.width, self.height)
+    
+    def handle_events(self, events):
+        """Motion moves the mouse, the wheel nudges zvelocity and q quits"""
+        for event in events:
+            if event.kind == "motion":
+                self.mousex = event.x
+                self.mousey = event.y
+            elif event.kind == "wheel":
+                if event.button == 1:
+                    self.zvelocity -= 0.01
+                elif event.button == 0:
+                    self.zvelocity += 0.01
+            elif event.kind == "key" and event.button == ord("q"):
+                self.running = False
+            elif event.kind == "key" and event.button == ord("s"):
+                # Stage timing starts the first time the overlay is shown
+                self.show_stats = not self.show_stats
+                self.perf_monitor.enable_stages()
+            elif event.kind == "key" and event.button == ord("p"):
+                self.profile_toggle = True
     
-    # Update performance monitoring
-    frame_time = perf_monitor.update()
+    def check_profiler(self):
+        """At a frame boundary, start or stop the capture if p was pressed, so it holds whole frames"""
+        if self.profile_toggle:
+            self.profile_toggle = False
+            self.profiler.toggle()
     
-    # Adaptive frame rate
-    elapsed = time.time() - frame_start
-    if elapsed < target_frame_time:
-        time.sleep(target_frame_time - elapsed)
+    def poll_input(self):
+        """Polling input for the classic loop: drain stdin before the frame is rendered"""
+        self.check_resize()
+        
+        # Raw bytes straight from the fd; partial reports wait in the parser
+        data = b""
+        while select.select([self.stdin_fd], [], [], 0)[0]:
+            chunk = os.read(self.stdin_fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+        if data:
+            self.handle_events(self.mouse_parser.feed(data))
+    
+    def on_stdin_ready(self, fd):
+        """asyncio reader callback: handle mouse and keys as soon as they arrive"""
+        stages = self.perf_monitor.stages
+        if stages:
+            start = time.perf_counter()
+        self.handle_events(self.mouse_parser.feed(os.read(fd, 4096)))
+        if stages:
+            stages.record("input", time.perf_counter() - start)
+    
+    def advance(self):
+        """Run as many fixed simulation steps as real time has passed since the last call"""
+        now = time.perf_counter()
+        if self.sim_time is None:
+            self.sim_time = now
+        self.sim_accumulator += min(now - self.sim_time, self.MAX_CATCH_UP)
+        self.sim_time = now
+        while self.sim_accumulator >= self.SIM_DT:
+            self.prev_offsets = (self.xoffset, self.yoffset, self.zoffset)
+            self.update()
+            self.sim_accumulator -= self.SIM_DT
+    
+    def render_offsets(self):
+        """Offsets blended between the last two steps by how far we are into the next one"""
+        alpha = self.sim_accumulator / self.SIM_DT
+        px, py, pz = self.prev_offsets
+        return (px + (self.xoffset - px) * alpha,
+                py + (self.yoffset - py) * alpha,
+                pz + (self.zoffset - pz) * alpha)
+    
+    def update(self):
+        """Advance the offsets by one simulation step's worth of velocity"""
+        # Update positions (batch these calculations)
+        xcentre = self.width/2
+        ycentre = self.height/2
+        
+        # Simplified velocity calculations
+        self.xvelocity = (self.mousex - xcentre) * 0.001
+        self.yvelocity = (self.mousey - ycentre) * 0.001
+        
+        self.xoffset += self.xvelocity
+        self.yoffset += self.yvelocity
+        self.zoffset += self.zvelocity
     
-    # Update dynamic range less frequently
-    if framecount % 10 == 0:
-        [mx, b] = mxplusb(0, minfound, 255, maxfound)
+    def render(self):
+        """Render, encode and write one frame"""
+        global minfound, maxfound
+        render_start = time.perf_counter()
+        renderer = self.renderer
+        differ = self.differ
+        perf_monitor = self.perf_monitor
+        stages = perf_monitor.stages
+        
+        # Render frame with optimizations
+        xoffset, yoffset, zoffset = self.render_offsets()
+        field = renderer.sample_field(xoffset, yoffset, zoffset)
+        if stages:
+            stages.lap("noise")
+        vals, palette = renderer.colour_field(field, self.mx, self.b, self.framecount)
+        minfound = min(minfound, renderer.field_min)
+        maxfound = max(maxfound, renderer.field_max)
+        if stages:
+            stages.lap("colour")
+        
+        if self.show_stats and stages:
+            # Percentiles are not free, so the overlay only refreshes a few times a second
+            if self.framecount % 10 == 0 or not self.stats_line:
+                self.stats_line = stages.overlay()
+            header = self.stats_line
+        else:
+            # Header with performance info
+            current_fps = perf_monitor.get_fps()
+            p50, p95, p99 = perf_monitor.get_percentiles()
+            hit_ratio = renderer.get_cache_stats()[0]
+            bytes_raw, _ = renderer.get_encode_stats()
+            header = f"Mouse: {self.mousex:3d},{self.mousey:3d} Vel: {self.xvelocity:.3f},{self.yvelocity:.3f},{self.zvelocity:.3f} FPS: {current_fps:.1f} Scale: 1/{renderer.scale} Cache: {hit_ratio:.0f}% Out: {self.bytes_out/1024:.1f}k/{bytes_raw/1024:.1f}k Frame: {p50:.1f}/{p95:.1f}/{p99:.1f}ms Miss: {perf_monitor.deadlines_missed} Skip: {perf_monitor.frames_skipped}"
+        profiler = self.profiler
+        if profiler.active or profiler.saved_at:
+            if profiler.active:
+                profiler.frames += 1
+            header = profiler.status() + header
+        # Never let the header wrap, or every frame line below it shifts down
+        header = f"\x1B[1;1H\x1B[0m{header[:self.width]}\x1B[1E"
+        
+        if self.encoder:
+            encoder = self.encoder
+            if self.pipeline:
+                # Fill whichever of the two buffers the writer thread is not using
+                encoder, dropped = self.pipeline.acquire()
+                if dropped and differ:
+                    # The terminal never sees the dropped frame, so diff against nothing
+                    differ.reset()
+            
+            # Straight from the value array into a reused byte buffer and out via os.write
+            frame = encoder.encode(header.encode(), vals, palette)
+            if stages:
+                stages.lap("encode")
+            if differ:
+                diff = differ.encode(renderer.colours, encoder.frame_size)
+                if diff is not None:
+                    frame = (header + diff).encode()
+                if stages:
+                    stages.lap("diff")
+            
+            if self.pipeline:
+                if self.pipeline.submit(encoder, frame):
+                    # The full frame went out instead, so that is what the terminal shows
+                    frame = encoder.frame
+                    if differ:
+                        differ.full_repaint(renderer.colours)
+            else:
+                write_all(self.stdout_fd, frame)
+            self.bytes_out = len(frame)
+        else:
+            frame_lines = renderer.encode_frame(vals, palette)
+            full_size = renderer.bytes_encoded + 4 * len(frame_lines)
+            if stages:
+                stages.lap("encode")
+            
+            # Build complete output in one buffer
+            main_output = self.main_output
+            main_output.clear()
+            main_output.append(header)
+            
+            # Changed cells only when that is cheaper, otherwise all frame lines
+            diff = None
+            if differ:
+                diff = differ.encode(renderer.colours, full_size)
+                if stages:
+                    stages.lap("diff")
+            if diff is not None:
+                main_output.append(diff)
+            else:
+                for line in frame_lines:
+                    main_output.append(line)
+                    main_output.append("\x1B[1E")
+            
+            # Single output operation
+            output = ''.join(main_output)
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            self.bytes_out = len(output.encode()) if renderer.half_block else len(output)
+        
+        # Update performance monitoring
+        if stages:
+            stages.lap("write")
+            stages.end_frame(self.bytes_out, renderer.samples_computed)
+        perf_monitor.add_work_time(time.perf_counter() - render_start)
+        perf_monitor.update()
+        if self.quality:
+            renderer.scale = self.quality.update()
+        
+        # Update dynamic range less frequently
+        if self.framecount % 10 == 0:
+            [self.mx, self.b] = mxplusb(0, minfound, 255, maxfound)
+    
+    def run(self):
+        """Classic loop: poll input, render if on schedule, then sleep until the deadline"""
+        scheduler = self.scheduler
+        while True:
+            self.framecount += 1
+            self.check_profiler()
+            on_time = scheduler.begin()
+            stages = self.perf_monitor.stages
+            if stages:
+                stages.start()
+            
+            self.poll_input()
+            if not self.running:
+                break
+            if stages:
+                stages.lap("input")
+            
+            # The simulation follows the clock; only drawing is skipped when behind
+            self.advance()
+            if stages:
+                stages.lap("sim")
+            if on_time:
+                self.render()
+            
+            delay = scheduler.end(on_time)
+            if delay:
+                time.sleep(delay)
+            if stages:
+                stages.lap("sleep")
+    
+    async def run_async(self):
+        """asyncio runtime: stdin is a reader callback, rendering a timed task"""
+        loop = asyncio.get_running_loop()
+        stdin_fd = self.stdin_fd
+        loop.add_reader(stdin_fd, self.on_stdin_ready, stdin_fd)
+        try:
+            scheduler = self.scheduler
+            while self.running:
+                self.framecount += 1
+                self.check_profiler()
+                on_time = scheduler.begin()
+                stages = self.perf_monitor.stages
+                if stages:
+                    stages.start()
+                
+                self.check_resize()
+                self.advance()
+                if stages:
+                    stages.lap("sim")
+                if on_time:
+                    self.render()
+                
+                # Sleeping in the loop lets input callbacks run the moment bytes arrive
+                # (even an uncapped loop yields to them once per frame)
+                await asyncio.sleep(scheduler.end(on_time))
+                if stages:
+                    # Includes any input callbacks run meanwhile, which are also timed as "input"
+                    stages.lap("sleep")
+        finally:
+            loop.remove_reader(stdin_fd)
+    
+    def close(self):
+        if self.pipeline:
+            self.pipeline.close()
+
+def main():
+    """Run the interactive visualiser until q or Ctrl-C"""
+    global minfound, maxfound, monitor, profiler
+    
+    parser = argparse.ArgumentParser(description="Mouse-driven Perlin noise in the terminal")
+    parser.add_argument("--snap", action="store_true",
+                        help="snap panning to whole cells and reuse the previous frame's samples")
+    parser.add_argument("--quantize", type=int, default=1, metavar="N",
+                        help="snap colour values to multiples of N so runs coalesce (default: 1)")
+    parser.add_argument("--half-block", action="store_true",
+                        help="draw two samples per cell with ▀ for double vertical resolution")
+    parser.add_argument("--workers", type=int, default=0, metavar="N",
+                        help="render noise in N worker processes via shared memory (default: off)")
+    parser.add_argument("--stdio", action="store_true",
+                        help="write frames as text through sys.stdout instead of os.write")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="write each frame on a background thread while the next is rendered")
+    parser.add_argument("--diff", action="store_true",
+                        help="only redraw cells whose colour changed since they were last drawn")
+    parser.add_argument("--diff-threshold", type=int, default=0, metavar="N",
+                        help="per-channel colour change ignored by --diff (default: 0)")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run on an asyncio event loop with stdin as a reader")
+    parser.add_argument("--stats", action="store_true",
+                        help="time every stage of the frame and show it in the header (toggle with s)")
+    parser.add_argument("--profile-dir", default="profiles", metavar="DIR",
+                        help="where p writes .pstats and collapsed-stack captures (default: profiles)")
+    parser.add_argument("--fps", type=float, default=30, metavar="N",
+                        help="target frame rate, 0 for uncapped (default: 30)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="sample a coarser grid when frames run over budget")
+    parser.add_argument("--upscale", choices=("nearest", "bilinear"), default="bilinear",
+                        help="how --adaptive fills in cells between samples (default: bilinear)")
+    parser.add_argument("--max-scale", type=int, default=4, metavar="N",
+                        help="coarsest --adaptive grid, sampling every Nth cell (default: 4)")
+    parser.add_argument("--palette", choices=Palette.NAMES, default="classic",
+                        help="colour gradient for noise values (default: classic, with cycling blue)")
+    parser.add_argument("--fractal", choices=FractalNoise.MODES,
+                        help="sum several octaves of noise as fbm, ridged or turbulence")
+    parser.add_argument("--octaves", type=int, default=4, metavar="N",
+                        help="octaves summed by --fractal (default: 4)")
+    parser.add_argument("--lacunarity", type=float, default=2.0, metavar="F",
+                        help="frequency multiplier between --fractal octaves (default: 2.0)")
+    parser.add_argument("--persistence", type=float, default=0.5, metavar="F",
+                        help="amplitude multiplier between --fractal octaves (default: 0.5)")
+    parser.add_argument("--cache-mb", type=float, default=16, metavar="MB",
+                        help="byte budget of the --snap tile cache, 0 to disable (default: 16)")
+    parser.add_argument("--volume", metavar="PATH",
+                        help="look samples up in a volume baked by bake_volume.py instead of computing them")
+    parser.add_argument("--volume-density", type=int, default=10, metavar="N",
+                        help="samples per noise unit the --volume was baked with (default: 10)")
+    parser.add_argument("--z-keyframe", type=float, default=0.0, metavar="DZ",
+                        help="sample full slices only every DZ along z and blend between them; "
+                             "pans in whole cells (0.04 is every 4th step at one wheel notch)")
+    args = parser.parse_args()
+    if args.pipeline and args.stdio:
+        parser.error("--pipeline writes through os.write and cannot be combined with --stdio")
+    if args.fps < 0:
+        parser.error("--fps must be 0 (uncapped) or positive")
+    if args.adaptive and not args.fps:
+        parser.error("--adaptive needs a frame budget, so it cannot be used with --fps 0")
+    if args.max_scale < 1:
+        parser.error("--max-scale must be at least 1")
+    if args.fractal and (args.snap or args.z_keyframe or args.volume or args.workers
+                         or args.adaptive):
+        parser.error("--fractal samples every octave itself and cannot be combined with "
+                     "--snap, --z-keyframe, --volume, --workers or --adaptive")
+    if args.volume and (args.snap or args.z_keyframe or args.workers or args.adaptive):
+        parser.error("--volume looks every sample up in the baked volume and cannot be combined "
+                     "with --snap, --z-keyframe, --workers or --adaptive")
+    if args.volume_density < 1:
+        parser.error("--volume-density must be positive")
+    if args.octaves < 1:
+        parser.error("--octaves must be at least 1")
+    if args.lacunarity <= 0 or args.persistence <= 0:
+        parser.error("--lacunarity and --persistence must be positive")
+    if args.cache_mb < 0:
+        parser.error("--cache-mb must be 0 (off) or positive")
+    if args.z_keyframe < 0:
+        parser.error("--z-keyframe must be positive, or 0 for off")
+    if args.z_keyframe and (args.snap or args.workers):
+        parser.error("--z-keyframe samples its own keyframe slices and cannot be combined "
+                     "with --snap or --workers")
+    if args.snap and args.workers:
+        parser.error("--snap samples only the strips scrolled into view, in-process, "
+                     "so it cannot be combined with --workers")
+
+    signal.signal(signal.SIGINT, signal_handler)
+
+    screen = curses.initscr()
+    curses.curs_set(0)
+    screen.keypad(1)
+    curses.mouseinterval(0)
+    curses.mousemask(curses.ALL_MOUSE_EVENTS)
+    screen.nodelay(1)
+    curses.noecho()
+    curses.raw()
+    curses.cbreak()
+
+    minfound = 0.0
+    maxfound = 0.0
+
+    app = NoiseApp(screen, args)
+    monitor = app.perf_monitor
+    profiler = app.profiler
+    # Replaces curses' own handler; we never draw through curses
+    signal.signal(signal.SIGWINCH, app.on_winch)
+
+    # Open debug file only once
+    fh = open("debug.txt", "w")
+
+    # Enable mouse tracking
+    sys.stdout.write("\x1B[?1003h\x1B[?1015h\x1B[?1006h")
+    sys.stdout.flush()
+
+    if args.asyncio:
+        asyncio.run(app.run_async())
+    else:
+        app.run()
+
+    # Cleanup
+    app.close()
+    curses.curs_set(1)
+    curses.endwin()
+    fh.close()
+    signal_handler(0, 0)
 
-# Cleanup
-curses.curs_set(1)
-curses.endwin()
-fh.close()
-signal_handler(0, 0)
\ No newline at end of file
+if __name__ == "__main__":
+    main()